@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Замеры производительности: проверка выгрузки, методы хранилищ, обработчики
+отчетов через тестовый клиент aiohttp и кеш. Работает без сети и mongodb.
+
+Результаты пишутся в JSON и сравниваются с сохраненным `baseline.json`:
+если замер медленнее базового больше чем на `--threshold`, скрипт
+завершается с кодом 1.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import pathlib
+import platform
+import random
+import sys
+import tempfile
+import time
+
+if __name__ == '__main__':
+    # NOTE: при запуске скриптом корень проекта не в sys.path
+    sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from citizens.app import CitizensRestApi
+from citizens.cache import CitizensFileCache, CitizensSharedMemoryCache
+from citizens.codec import CODEC_CLASSES, get_codec
+from citizens.memory_storage import MemoryStorage
+from citizens.schema import validate_citizens
+from citizens.sqlite_storage import SQLiteStorage
+
+from tests.scripts.data import ImportDataGenerator
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+
+async def measure(func, repeat, setup=None):
+    """
+    Лучшее время из `repeat` запусков, `setup` выполняется перед каждым и не
+    замеряется. Сборщик мусора на время замера выключен, как в `timeit`.
+    """
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            await setup()
+        gc.collect()
+        gc.disable()
+        try:
+            t1 = time.perf_counter()
+            result = func()
+            if asyncio.iscoroutine(result):
+                await result
+            elapsed = time.perf_counter() - t1
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+async def _consume(iterator):
+    async for _ in iterator:
+        pass
+
+
+def copy_citizens(citizens):
+    return [dict(citizen, relatives=list(citizen['relatives'])) for citizen in citizens]
+
+
+async def benchmark_validation(results, citizens, repeat):
+    size = len(citizens)
+    results[f'validate_citizens/{size}'] = await measure(lambda: validate_citizens(citizens), repeat)
+
+
+async def benchmark_storage(results, name, create_storage, citizens, repeat):
+    size = len(citizens)
+    codec = get_codec()
+    storage = create_storage()
+    try:
+        results[f'{name}.import_citizens/{size}'] = await measure(
+            lambda: storage.import_citizens(copy_citizens(citizens)), repeat)
+        import_id = await storage.import_citizens(copy_citizens(citizens))
+        citizen = citizens[len(citizens) // 2]
+        values = {'name': 'Benchmark', 'relatives': citizen['relatives'][:1]}
+        cases = {
+            'get_citizens': lambda: storage.get_citizens(import_id),
+            'iter_citizens': lambda: _consume(storage.iter_citizens(import_id)),
+            'iter_citizens_json': lambda: _consume(storage.iter_citizens_json(import_id, codec)),
+            'update_citizen': lambda: storage.update_citizen(import_id, citizen['citizen_id'], values),
+            'get_import_version': lambda: storage.get_import_version(import_id),
+            'get_presents_by_month': lambda: storage.get_presents_by_month(import_id),
+            'get_ages_by_town': lambda: storage.get_ages_by_town(import_id),
+        }
+        for method, func in cases.items():
+            results[f'{name}.{method}/{size}'] = await measure(func, repeat)
+    finally:
+        await storage.close()
+
+
+async def benchmark_handlers(results, citizens, repeat, tmpdir):
+    size = len(citizens)
+    # NOTE: свой конфиг, чтобы не трогать кеш и метрики запущенного на этой машине сервиса
+    api = CitizensRestApi(nolog=True, config={
+        'use_cache': True,
+        'cache': {'class': 'CitizensSharedMemoryCache', 'path': os.path.join(tmpdir, 'handlers.cache')},
+        'json_codec': 'orjson' if 'orjson' in CODEC_CLASSES else 'json',
+        'storage': {'class': 'MemoryStorage'},
+    })
+    app = api._app
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        import_id = await app.storage.import_citizens(copy_citizens(citizens))
+
+        async def clear_cache():
+            app.cache.clear(import_id)
+
+        for handler, uri in (
+            ('get_citizens', f'/imports/{import_id}/citizens'),
+            ('get_presents_by_month', f'/imports/{import_id}/citizens/birthdays'),
+            ('get_age_percentiles', f'/imports/{import_id}/towns/stat/percentile/age'),
+        ):
+            async def request(uri=uri):
+                response = await client.get(uri)
+                await response.read()
+                assert response.status == 200, response.status
+
+            # Ответ собирается заново и кладется в кеш
+            results[f'handler.{handler}/{size}'] = await measure(request, repeat, setup=clear_cache)
+            # Ответ из кеша
+            results[f'handler.{handler}.cached/{size}'] = await measure(request, repeat)
+    finally:
+        await client.close()
+
+
+async def benchmark_cache(results, citizens, repeat, tmpdir):
+    size = len(citizens)
+    body = get_codec().dumps({'data': citizens})
+    caches = (
+        ('CitizensSharedMemoryCache', CitizensSharedMemoryCache(path=os.path.join(tmpdir, 'bench.cache'))),
+        ('CitizensFileCache', CitizensFileCache(cache_dir=os.path.join(tmpdir, 'bench.cache.d'))),
+    )
+    for name, cache in caches:
+        try:
+            results[f'{name}.put/{size}'] = await measure(lambda: cache.put(1, 'get_citizens', body), repeat)
+            results[f'{name}.get/{size}'] = await measure(lambda: cache.get(1, 'get_citizens'), repeat)
+        finally:
+            cache.close()
+
+
+async def run(sizes, repeat):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storages = (
+            ('MemoryStorage', lambda: MemoryStorage({})),
+            ('SQLiteStorage', lambda: SQLiteStorage({'path': os.path.join(tmpdir, f'{time.time_ns()}.sqlite3')})),
+        )
+        for size in sizes:
+            # NOTE: одни и те же данные при каждом запуске, иначе замеры не сравнить
+            random.seed(size)
+            citizens = ImportDataGenerator().generate_import_data(size)['citizens']
+            await benchmark_validation(results, citizens, repeat)
+            for name, create_storage in storages:
+                await benchmark_storage(results, name, create_storage, citizens, repeat)
+            await benchmark_handlers(results, citizens, repeat, tmpdir)
+            await benchmark_cache(results, citizens, repeat, tmpdir)
+    return results
+
+
+def compare(results, baseline, threshold, min_time=0.0):
+    """
+    Возвращает замеры, которые медленнее базовых больше чем на `threshold`.
+    Совсем короткие замеры (меньше `min_time` секунд) слишком шумные, их не сравниваем.
+    """
+    regressions = []
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None or base <= 0 or max(base, value) < min_time:
+            continue
+        ratio = value / base
+        if ratio > 1 + threshold:
+            regressions.append((name, base, value, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Citizens benchmarks')
+    parser.add_argument('--sizes', default='1000,10000')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--output', default=os.path.join(BENCHMARKS_DIR, 'results.json'))
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.3,
+                        help='допустимое замедление относительно базового замера, 0.3 - на 30%%')
+    parser.add_argument('--min-time', type=float, default=0.0005,
+                        help='замеры короче (в секундах) не сравниваются')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='сохранить результаты как новый базовый замер')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = asyncio.run(run(sizes, args.repeat))
+    output = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        diff = '' if not base else '{0:+.1f}%'.format((value / base - 1) * 100)
+        print('{0:<56} {1:>10.3f} ms {2:>9}'.format(name, value * 1000, diff))
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.baseline}')
+        return
+    regressions = compare(results, baseline, args.threshold, args.min_time)
+    for name, base, value, ratio in regressions:
+        print('REGRESSION {0}: {1:.3f} ms -> {2:.3f} ms (x{3:.2f})'.format(
+            name, base * 1000, value * 1000, ratio))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
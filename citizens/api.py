@@ -1,33 +1,79 @@
-import functools
-import numpy as np
-
 from aiohttp import web
 from aiojobs.aiohttp import atomic
 
-from citizens.cache import use_cache, clear_cache
+from citizens import reports
+from citizens.cache import use_cache, use_etag, clear_cache
+from citizens.jsonstream import (
+    BytesStream, JsonArrayReader, JsonBodyTooLarge, JsonStreamError
+)
+from citizens.parallel import read_shared_body
 from citizens.schema import (
-    validate_citizens, CitizenSchema, DataValidationError
+    CitizensValidator, CitizenSchema, DataValidationError
 )
-from citizens.storage import CitizenNotFound
+from citizens.storage import CitizenNotFound, RelativeNotFound
+from citizens.timing import stage
+
+
+VALIDATION_BATCH_SIZE = 1000
 
 
 class CitizensBadRequest(Exception):
     pass
 
 
+async def _read_citizens(stream, max_size):
+    # NOTE: тело запроса не читаем целиком, а разбираем и проверяем жителей
+    # по мере поступления, чтобы на невалидных данных падать сразу
+    reader = JsonArrayReader(stream, 'citizens', max_size=max_size)
+    validator = CitizensValidator()
+    citizens = []
+    # NOTE: проверяем пачками, часть проверок (дата рождения) делается
+    # сразу на всю пачку
+    # NOTE: чтение и разбор идут вперемешку с проверкой, поэтому в `read`
+    # попадает и разбор JSON, а проверка считается отдельно
+    with stage('read'):
+        async for citizen in reader:
+            citizens.append(citizen)
+            if len(citizens) % VALIDATION_BATCH_SIZE == 0:
+                with stage('validate'):
+                    validator.validate_many(citizens[-VALIDATION_BATCH_SIZE:])
+    if not reader.key_found:
+        raise CitizensBadRequest('Key `citizens` not found.')
+    with stage('validate'):
+        validator.validate_many(citizens[len(citizens) - len(citizens) % VALIDATION_BATCH_SIZE:])
+        validator.finish()
+    return citizens
+
+
 @atomic
 async def new_import(request):
-    import_data = await request.json()
-    if 'citizens' not in import_data:
-        raise CitizensBadRequest('Key `citizens` not found.')
-    citizens = import_data['citizens']
+    stream = request.content
+    citizens = None
     try:
-        validate_citizens(citizens)
-    except DataValidationError as e:
+        # Большие выгрузки разбираем и проверяем в пуле процессов
+        pool = request.app.import_validator
+        size = request.content_length or 0
+        if pool is not None and pool.min_size <= size <= request.app.client_body_max_size:
+            with stage('read'):
+                body = await read_shared_body(request.content, size)
+            try:
+                with stage('validate'):
+                    citizens = await pool.validate(body)
+                if citizens is None:
+                    stream = BytesStream(body.view.tobytes())
+            finally:
+                body.close()
+        if citizens is None:
+            citizens = await _read_citizens(stream, request.app.client_body_max_size)
+    except JsonBodyTooLarge as e:
+        raise web.HTTPRequestEntityTooLarge(max_size=e.max_size, actual_size=e.actual_size)
+    except (JsonStreamError, DataValidationError) as e:
         raise CitizensBadRequest(str(e))
-    import_id = await request.app.storage.import_citizens(citizens)
+    with stage('storage'):
+        import_id = await request.app.storage.import_citizens(citizens)
     out = {'data': {'import_id': import_id}}
-    return web.json_response(data=out, status=201)
+    with stage('serialize'):
+        return request.app.codec.response(out, status=201)
 
 
 @atomic
@@ -35,61 +81,106 @@ async def new_import(request):
 async def update_citizen(request):
     import_id = int(request.match_info['import_id'])
     citizen_id = int(request.match_info['citizen_id'])
-    values = await request.json()
+    with stage('read'):
+        body = await request.read()
+    try:
+        with stage('decode'):
+            values = request.app.codec.loads(body)
+    except ValueError as e:
+        raise CitizensBadRequest('Invalid JSON.') from e
     if not values:
         raise CitizensBadRequest('No values.')
     if 'citizen_id' in values:
         raise CitizensBadRequest('Forbidden to update field `citizen_id`.')
     try:
-        CitizenSchema().validate(values, partial=True)
+        with stage('validate'):
+            CitizenSchema().validate(values, partial=True)
     except DataValidationError as e:
         raise CitizensBadRequest(str(e))
-    storage = request.app.storage
-    if 'relatives' in values:
-        new_relatives = values['relatives']
-        relatives = list(await storage.get_citizens(
-            import_id,
-            filter={'citizen_id': new_relatives},  # NOTE: citizen_id in new_relatives
-            return_fields=['citizen_id']
-        ))
-        if len(relatives) != len(new_relatives):
-            raise CitizensBadRequest('Invalid value for `relatives`.')
+    # NOTE: существование родственников проверяет само хранилище
     try:
-        updated_data = await storage.update_citizen(import_id, citizen_id, values)
+        with stage('storage'):
+            updated_data = await request.app.storage.update_citizen(import_id, citizen_id, values)
     except CitizenNotFound as e:
         raise CitizensBadRequest() from e
-    return web.json_response(data={'data': updated_data})
+    except RelativeNotFound as e:
+        raise CitizensBadRequest('Invalid value for `relatives`.') from e
+    with stage('serialize'):
+        return request.app.codec.response({'data': updated_data})
 
 
 @use_cache('get_citizens')
+@use_etag('get_citizens')
 async def get_citizens(request):
     import_id = int(request.match_info['import_id'])
-    citizens = list(await(request.app.storage.get_citizens(import_id)))
-    return web.json_response(data={'data': citizens})
+    codec = request.app.codec
+    batches = request.app.storage.iter_citizens_json(import_id, codec)
+    # NOTE: первую пачку получаем до отправки заголовков, чтобы ошибки
+    # (например, ImportNotFound) ещё можно было превратить в нормальный ответ
+    # NOTE: в `storage` входит и кодирование пачек в JSON
+    try:
+        with stage('storage'):
+            batch = await batches.__anext__()
+    except StopAsyncIteration:
+        batch = b''
+    response = web.StreamResponse()
+    response.content_type = 'application/json'
+    response.charset = 'utf-8'
+    await response.prepare(request)
+    # Если включен кеш, собираем тело, чтобы потом положить его в кеш
+    parts = [] if hasattr(request.app, 'cache') else None
+    chunk = b'{"data": ['
+    separator = b''
+    while True:
+        if batch:
+            chunk += separator + batch
+            separator = b', '
+        await response.write(chunk)
+        if parts is not None:
+            parts.append(chunk)
+        try:
+            batch = await batches.__anext__()
+        except StopAsyncIteration:
+            break
+        chunk = b''
+    await response.write(b']}')
+    await response.write_eof()
+    if parts is not None:
+        parts.append(b']}')
+        response['cached_body'] = b''.join(parts)
+    return response
 
 
 @use_cache('get_presents_by_month')
+@use_etag('get_presents_by_month')
 async def get_presents_by_month(request):
     import_id = int(request.match_info['import_id'])
-    report = await request.app.storage.get_presents_by_month(import_id)
+    with stage('storage'):
+        report = await request.app.storage.get_presents_by_month(import_id)
     presents_by_month = {entry['month']: entry['citizens'] for entry in report}
     for month in range(1, 13):
         if month not in presents_by_month:
             presents_by_month[month] = []
-    return web.json_response(data={'data': presents_by_month})
+    with stage('serialize'):
+        return request.app.codec.response({'data': presents_by_month})
 
 
 @use_cache('get_age_percentiles')
+@use_etag('get_age_percentiles')
 async def get_age_percentiles(request):
     import_id = int(request.match_info['import_id'])
-    report = await request.app.storage.get_ages_by_town(import_id)
-    percentile = functools.partial(np.percentile, interpolation='linear')
-    age_percentiles = [
-        {
-            'town': entry['town'],
-            'p50': round(percentile(entry['ages'], 50), 2),
-            'p75': round(percentile(entry['ages'], 75), 2),
-            'p99': round(percentile(entry['ages'], 99), 2),
-        } for entry in report
-    ]
-    return web.json_response(data={'data': age_percentiles})
+    with stage('storage'):
+        report = await request.app.storage.get_ages_by_town(import_id)
+    # NOTE: в отчете гистограммы возрастов, перцентили считаем по ним
+    percentile = reports.percentile
+    with stage('percentile'):
+        age_percentiles = [
+            {
+                'town': entry['town'],
+                'p50': round(percentile(entry['ages'], 50), 2),
+                'p75': round(percentile(entry['ages'], 75), 2),
+                'p99': round(percentile(entry['ages'], 99), 2),
+            } for entry in report
+        ]
+    with stage('serialize'):
+        return request.app.codec.response({'data': age_percentiles})
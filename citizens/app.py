@@ -14,8 +14,20 @@ from citizens.api import (
     CitizensBadRequest, new_import, update_citizen, get_citizens,
     get_presents_by_month, get_age_percentiles
 )
-from citizens.cache import citizens_cache_setup
-from citizens.storage import AsyncMongoStorage, ImportNotFound
+from citizens.cache import citizens_cache_setup, set_cache_headers
+from citizens.codec import get_codec
+from citizens.memory_storage import MemoryStorage
+from citizens.metrics import citizens_metrics_setup, metrics_middleware
+from citizens.parallel import ParallelImportValidator
+from citizens.sqlite_storage import SQLiteStorage
+from citizens.storage import AsyncMongoStorage, MotorMongoStorage, ImportNotFound
+from citizens.timing import server_timing_middleware, set_server_timing_header
+
+
+STORAGE_CLASSES = {
+    cls.__name__: cls
+    for cls in (AsyncMongoStorage, MotorMongoStorage, MemoryStorage, SQLiteStorage)
+}
 
 
 @contextmanager
@@ -56,17 +68,21 @@ async def logging_middleware(request, handler):
     logger.debug('> [{0}] {1} {2}'.format(request_id, request.method, request.url))
     response = await handler(request)
     status = '{0} {1}'.format(response.status, response.reason)
-    logger.debug('< [{0}] {1} {2}'.format(request_id, status, response.body[:50]))
+    body = (response.body or b'') if isinstance(response, web.Response) else b'<stream>'
+    logger.debug('< [{0}] {1} {2}'.format(request_id, status, body[:50]))
     return response
 
 
 class CitizensRestApi:
-    def __init__(self, nolog=False):
+    def __init__(self, nolog=False, config=None):
+        """`config` - готовый конфиг вместо `citizens.config.json`, логирование он не настраивает."""
         self._logger = logging.getLogger('citizens')
         if nolog:
             self._logger.disabled = True
-        config_filepath = join(dirname(dirname(__file__)), 'citizens.config.json')
-        self._config = self._load_config(config_filepath)
+        if config is None:
+            config_filepath = join(dirname(dirname(__file__)), 'citizens.config.json')
+            config = self._load_config(config_filepath)
+        self._config = config
         self._unix_socket = None
         self._app = self._create_app()
 
@@ -95,15 +111,32 @@ class CitizensRestApi:
         asyncio.set_event_loop(loop)
         client_body_max_size = self._config.get('client_body_max_size', 1024 ** 2)
         middlewares = [errors_middleware]
+        metrics_config = self._config.get('metrics')
+        if metrics_config is not None:
+            # NOTE: снаружи всех, чтобы видеть итоговый статус ответа
+            middlewares.insert(0, metrics_middleware)
+        if self._config.get('server_timing'):
+            middlewares.append(server_timing_middleware)
         if self._config.get('debug'):
             middlewares.append(logging_middleware)
         app = web.Application(logger=self._logger, middlewares=middlewares, client_max_size=client_body_max_size)
+        app.client_body_max_size = client_body_max_size
         aiojobs_setup(app)
+        app.codec = get_codec(self._config.get('json_codec', 'json'))
         if self._config.get('use_cache'):
-            citizens_cache_setup(app)
+            citizens_cache_setup(app, self._config.get('cache'))
+        app.import_validator = None
+        parallel_import_config = self._config.get('parallel_import')
+        if parallel_import_config is not None:
+            app.import_validator = ParallelImportValidator(parallel_import_config, app.codec)
         storage_config = self._config['storage']
-        # TODO: тут можно брать класс из конфига и создавать обект указанного в конфиге класса
-        app.storage = AsyncMongoStorage(storage_config)
+        storage_class_name = storage_config.get('class', AsyncMongoStorage.__name__)
+        if storage_class_name not in STORAGE_CLASSES:
+            raise ValueError(f'Unknown storage class `{storage_class_name}`.')
+        app.storage = STORAGE_CLASSES[storage_class_name](storage_config)
+        if metrics_config is not None:
+            citizens_metrics_setup(app, metrics_config)
+            app.storage.metrics = app.metrics
         app.add_routes([
             web.post('/imports', new_import),
             web.patch(r'/imports/{import_id:\d+}/citizens/{citizen_id:\d+}', update_citizen),
@@ -111,6 +144,8 @@ class CitizensRestApi:
             web.get(r'/imports/{import_id:\d+}/citizens/birthdays', get_presents_by_month),
             web.get(r'/imports/{import_id:\d+}/towns/stat/percentile/age', get_age_percentiles),
         ])
+        app.on_response_prepare.append(set_cache_headers)
+        app.on_response_prepare.append(set_server_timing_header)
         app.on_shutdown.append(self._shutdown)
         return app
 
@@ -135,6 +170,8 @@ class CitizensRestApi:
 
     async def _shutdown(self, app):
         await app.storage.close()
+        if app.import_validator is not None:
+            app.import_validator.close()
         if self._unix_socket is not None:
             filepath, sock = self._unix_socket
             if sock.fileno() != -1:
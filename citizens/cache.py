@@ -1,86 +1,439 @@
+import asyncio
+import fcntl
+import gzip
 import logging
+import mmap
 import os
 import shutil
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from os.path import exists, join, dirname
 
+import numpy as np
 from aiohttp import web
 
+from citizens.timing import stage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 async def __shutdown(app):
     app.cache.close()
 
 
-def citizens_cache_setup(app, max_size=10):
-    app.cache = CitizensFileCache(max_size)
+def citizens_cache_setup(app, config=None):
+    config = dict(config or {})
+    class_name = config.pop('class', CitizensFileCache.__name__)
+    if class_name not in CACHE_CLASSES:
+        raise ValueError(f'Unknown cache class `{class_name}`.')
+    app.cache = CACHE_CLASSES[class_name](**config)
     app.on_shutdown.append(__shutdown)
 
 
+# NOTE: сжатые варианты ответа считаются один раз, когда запись попадает в кеш
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)  # в порядке предпочтения
+# Каждый ответ занимает в кеше запись на несжатый вариант и на каждую кодировку
+RESPONSE_VARIANTS = len(ENCODINGS) + 1
+
+
+def _compress(data):
+    variants = {}
+    if len(data) < COMPRESS_MIN_SIZE:
+        return variants
+    variants['gzip'] = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=BROTLI_QUALITY)
+    return variants
+
+
+def _accepted_encodings(accept_encoding):
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name] = q
+    return [
+        encoding for encoding in ENCODINGS
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0
+    ]
+
+
+def _preferred_encoding(accept_encoding):
+    accepted = _accepted_encodings(accept_encoding)
+    return accepted[0] if accepted else None
+
+
+def _variant_key(cache_key, encoding):
+    return cache_key if encoding is None else f'{cache_key}.{encoding}'
+
+
+def _pack(etag, encoding, data):
+    # NOTE: ETag хранится вместе с телом, чтобы ответ из кеша и 304 не ходили в хранилище
+    return f'{encoding or ""} {etag or ""}\n'.encode() + data
+
+
+def _unpack(data):
+    separator = data.index(b'\n')
+    encoding, etag = data[:separator].decode().split(' ')
+    return etag or None, encoding or None, data[separator + 1:]
+
+
+def _make_response(request, etag, encoding, body):
+    if etag is not None:
+        if_none_match = request.headers.get('If-None-Match')
+        matched = if_none_match and _etag_match(if_none_match, etag)
+        if matched:
+            return _not_modified(request, matched)
+        request['etag'] = etag
+    response = web.Response(body=body, content_type='application/json')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+async def cache_call(cache, method, *args):
+    """Вызывает метод кеша; если у кеша блокирующий ввод-вывод, то в его `executor`."""
+    if cache.executor is None:
+        return method(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cache.executor, method, *args)
+
+
+async def _cached_response(request, cache, import_id, cache_key, encoding):
+    # NOTE: вариант под каждую кодировку есть всегда, поэтому достаточно одного обращения к кешу
+    data = await cache_call(cache, cache.get, import_id, _variant_key(cache_key, encoding))
+    if not data:
+        return None
+    return _make_response(request, *_unpack(data))
+
+
+async def _put_with_variants(request, import_id, cache_key, data):
+    """
+    Кладет в кеш ответ и его сжатые варианты. Маленькие ответы не сжимаются,
+    тогда под ключами сжатых вариантов лежит несжатое тело. Возвращает
+    {кодировка: (фактическая кодировка, тело)}.
+    """
+    loop = asyncio.get_running_loop()
+    compressed = await loop.run_in_executor(None, _compress, data)
+    variants = {None: (None, data)}
+    for encoding in ENCODINGS:
+        variants[encoding] = (encoding, compressed[encoding]) if encoding in compressed else (None, data)
+    cache = request.app.cache
+    # NOTE: пока собирали ответ, данные могли изменить, тогда он уже устарел
+    if await _version_changed(request, import_id, cache_key):
+        return variants
+    await cache_call(cache, _put_variants, cache, import_id, cache_key, request.get('etag'), variants)
+    # NOTE: данные могли изменить и между проверкой и записью, а второй
+    # `clear_cache` - пройти раньше записи
+    if await _version_changed(request, import_id, cache_key):
+        await cache_call(cache, cache.clear, import_id)
+    return variants
+
+
+async def _version_changed(request, import_id, cache_key):
+    if 'etag' not in request:
+        return False
+    version = await request.app.storage.get_import_version(import_id)
+    return request['etag'] != _make_etag(import_id, version, cache_key)
+
+
+def _put_variants(cache, import_id, cache_key, etag, variants):
+    for encoding, (actual_encoding, body) in variants.items():
+        cache.put(import_id, _variant_key(cache_key, encoding), _pack(etag, actual_encoding, body))
+
+
+def _count_cache_request(request, cache_key, result, size=0):
+    metrics = getattr(request.app, 'metrics', None)
+    if metrics is None:
+        return
+    metrics.inc('citizens_cache_requests_total', endpoint=cache_key, result=result)
+    if size:
+        metrics.inc('citizens_cache_served_bytes_total', size, endpoint=cache_key)
+
+
 def use_cache(cache_key):
+    """
+    Ответ берется из кеша вместе с его ETag, поэтому при попадании (и при
+    ответе 304) хранилище не используется. Должен стоять снаружи `use_etag`.
+    """
     def _use_cache(handler):
         async def wrapper(request):
             if not hasattr(request.app, 'cache'):
                 return await handler(request)
             import_id = int(request.match_info['import_id'])
             cache = request.app.cache
-            cached_data = cache.get(import_id, cache_key)
-            if cached_data:
-                return web.Response(body=cached_data, content_type='application/json')
-            else:
-                response = await handler(request)
-                cache.put(import_id, cache_key, response.body)
+            request['vary'] = 'Accept-Encoding'
+            encoding = _preferred_encoding(request.headers.get('Accept-Encoding', ''))
+            with stage('cache'):
+                response = await _cached_response(request, cache, import_id, cache_key, encoding)
+            if response is not None:
+                _count_cache_request(request, cache_key, 'hit', len(response.body or b''))
                 return response
+            _count_cache_request(request, cache_key, 'miss')
+            response = await handler(request)
+            if response.status != 200:
+                return response
+            if isinstance(response, web.Response):
+                with stage('cache'):
+                    variants = await _put_with_variants(request, import_id, cache_key, response.body)
+                # NOTE: варианты уже посчитаны, отдаем подходящий клиенту
+                actual_encoding, body = variants[encoding]
+                return _make_response(request, request.get('etag'), actual_encoding, body)
+            elif 'cached_body' in response:
+                # NOTE: потоковый ответ уже отправлен, тело собрал сам обработчик
+                await _put_with_variants(request, import_id, cache_key, response['cached_body'])
+            return response
         return wrapper
     return _use_cache
 
 
+def _etag_match(if_none_match, etag):
+    """Возвращает совпавший тег: у сжатых вариантов к тегу добавлена кодировка."""
+    variants = {etag} | {_encoded_etag(etag, encoding) for encoding in ENCODINGS}
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*':
+            return etag
+        if tag in variants:
+            return tag
+    return None
+
+
+def _make_etag(import_id, version, endpoint):
+    return f'"{import_id}-{version}-{endpoint}"'
+
+
+def _encoded_etag(etag, encoding):
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def _not_modified(request, etag):
+    headers = {'ETag': etag}
+    if hasattr(request.app, 'cache'):
+        headers['Vary'] = 'Accept-Encoding'
+    return web.Response(status=304, headers=headers)
+
+
+def use_etag(endpoint):
+    """
+    ETag ответа строится по версии выгрузки, которая меняется при каждом
+    изменении данных. Если клиент прислал такой же `If-None-Match`,
+    отвечаем 304 и не собираем тело ответа. Если ответ есть в кеше, ETag
+    берется из него (см. `use_cache`) и версия из хранилища не читается.
+    """
+    def _use_etag(handler):
+        async def wrapper(request):
+            import_id = int(request.match_info['import_id'])
+            with stage('storage'):
+                version = await request.app.storage.get_import_version(import_id)
+            etag = _make_etag(import_id, version, endpoint)
+            if_none_match = request.headers.get('If-None-Match')
+            matched = if_none_match and _etag_match(if_none_match, etag)
+            if matched:
+                return _not_modified(request, matched)
+            # NOTE: заголовок выставит set_cache_headers, в том числе для потоковых ответов
+            request['etag'] = etag
+            return await handler(request)
+        return wrapper
+    return _use_etag
+
+
+async def set_cache_headers(request, response):
+    if response.status != 200:
+        return
+    vary = request.get('vary')
+    if vary is not None:
+        response.headers['Vary'] = vary
+    etag = request.get('etag')
+    if etag is not None:
+        encoding = response.headers.get('Content-Encoding')
+        response.headers['ETag'] = etag if encoding is None else _encoded_etag(etag, encoding)
+
+
 def clear_cache(handler):
     async def wrapper(request):
         if not hasattr(request.app, 'cache'):
             return await handler(request)
         import_id = int(request.match_info['import_id'])
-        request.app.cache.clear(import_id)
-        return await handler(request)
+        cache = request.app.cache
+        await cache_call(cache, cache.clear, import_id)
+        response = await handler(request)
+        # NOTE: пока данные менялись, GET мог положить в кеш старый ответ
+        await cache_call(cache, cache.clear, import_id)
+        return response
     return wrapper
 
 
 class CitizensFileCache:
-    def __init__(self, max_size=10):
+    """
+    Кеш в файлах `/tmp/citizens.cache/{import_id}/{key}`, общий для всех процессов.
+
+    Размер ограничен количеством записей (`max_size`, по умолчанию на 10
+    ответов со всеми вариантами) и суммарным размером (`max_bytes`). При
+    превышении удаляются записи, которые дольше всего не читали (LRU).
+    Порядок записей процесс держит в памяти и раз в `rescan_interval`
+    секунд перечитывает каталог, чтобы учесть записи других процессов
+    (при чтении файлу обновляется mtime, поэтому порядок у всех общий).
+
+    Работа с файлами блокирующая, поэтому обработчики вызывают методы
+    кеша в `executor` (см. `cache_call`), один поток на кеш.
+    """
+    def __init__(self, max_size=10 * RESPONSE_VARIANTS, max_bytes=256 * 1024 ** 2,
+                 cache_dir='/tmp/citizens.cache', rescan_interval=10.0):
         self._max_size = max_size
-        self._citizens_by_import = {}
+        self._max_bytes = max_bytes
+        self._cache_dir = cache_dir
+        self._rescan_interval = rescan_interval
         self._logger = logging.getLogger('citizens')
+        self._index = OrderedDict()  # (import_id, key) -> размер, от давно не читанных к недавним
+        self._total_bytes = 0
+        self._scanned_at = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
 
     def _get_cache_path(self, import_id=None, key=None):
-        cache_path = '/tmp/citizens.cache'
+        cache_path = self._cache_dir
         if import_id is not None:
             cache_path = join(cache_path, str(import_id))
         if key is not None:
             cache_path = join(cache_path, key)
         return cache_path
 
+    def _index_put(self, import_id, key, size):
+        self._index_remove(import_id, key)
+        self._index[(import_id, key)] = size
+        self._total_bytes += size
+
+    def _index_remove(self, import_id, key):
+        size = self._index.pop((import_id, key), None)
+        if size is not None:
+            self._total_bytes -= size
+
     def put(self, import_id, key, data):
+        self._rescan_if_needed()
         filepath = self._get_cache_path(import_id, key)
         try:
-            if exists(filepath):
-                os.unlink(filepath)
-            else:
-                cache_dir = dirname(filepath)
-                os.makedirs(cache_dir, exist_ok=True)
-            with open(filepath, 'xb') as f:
+            os.makedirs(dirname(filepath), exist_ok=True)
+            # NOTE: пишем во временный файл и переименовываем, чтобы другой
+            # процесс не прочитал файл, записанный наполовину
+            tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+            with open(tmp_filepath, 'wb') as f:
                 f.write(data)
+            self._touch(tmp_filepath)
+            os.replace(tmp_filepath, filepath)
         except Exception:
             self._logger.error(f'Put to cache failed. `{filepath}`', exc_info=True)
+            return
+        self._index_put(import_id, key, len(data))
+        self._evict()
 
     def get(self, import_id, key):
         filepath = self._get_cache_path(import_id, key)
-        if exists(filepath):
+        try:
+            # тут внезапно файла может не оказаться, потому что его удалил другой процесс
+            with open(filepath, 'rb') as f:
+                data = f.read()
+            self._touch(filepath)
+        except FileNotFoundError:
+            self._index_remove(import_id, key)
+            self._misses += 1
+            return None
+        except Exception:
+            self._logger.error(f'Cannot read `{filepath}`', exc_info=True)
+            self._misses += 1
+            return None
+        # NOTE: запись другого процесса, которой еще нет в индексе, тоже учитываем
+        self._index_put(import_id, key, len(data))
+        self._hits += 1
+        return data
+
+    @staticmethod
+    def _touch(filepath):
+        # NOTE: время ставим явно, у файловой системы оно может быть грубым (до мс),
+        # тогда порядок записей, прочитанных почти одновременно, потеряется
+        now = time.time_ns()
+        os.utime(filepath, ns=(now, now))
+
+    def _rescan_if_needed(self):
+        now = time.monotonic()
+        if self._scanned_at is not None and now - self._scanned_at < self._rescan_interval:
+            return
+        self._scanned_at = now
+        entries = []
+        if exists(self._cache_dir):
+            for import_dir in os.scandir(self._cache_dir):
+                try:
+                    for entry in os.scandir(import_dir.path):
+                        if entry.name.endswith('.tmp'):
+                            continue
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime_ns, int(import_dir.name), entry.name, stat.st_size))
+                except (FileNotFoundError, ValueError):
+                    continue  # запись удалил другой процесс
+                self._remove_empty_dir(import_dir.path)
+        self._index.clear()
+        self._total_bytes = 0
+        for _, import_id, key, size in sorted(entries):
+            self._index_put(import_id, key, size)
+
+    @staticmethod
+    def _remove_empty_dir(path):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass  # в каталоге есть записи или его уже удалили
+
+    def _evict(self):
+        while self._index and (len(self._index) > self._max_size or self._total_bytes > self._max_bytes):
+            (import_id, key), size = self._index.popitem(last=False)
+            self._total_bytes -= size
             try:
-                # тут внезапно файла может не оказаться, потому что его удалил другой процесс
-                with open(filepath, 'rb') as f:
-                    return f.read()
-            except Exception:
-                self._logger.error(f'Cannot read `{filepath}`', exc_info=True)
-    
+                os.unlink(self._get_cache_path(import_id, key))
+                self._evictions += 1
+            except FileNotFoundError:
+                pass
+            self._remove_empty_dir(self._get_cache_path(import_id))
+
+    def stats(self):
+        """
+        Количество записей и их суммарный размер - по индексу текущего процесса,
+        попадания, промахи и вытеснения - только текущего процесса.
+        """
+        return {
+            'entries': len(self._index),
+            'bytes': self._total_bytes,
+            'max_entries': self._max_size,
+            'max_bytes': self._max_bytes,
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+        }
+
     def clear(self, import_id):
+        for cache_import_id, key in [k for k in self._index if k[0] == import_id]:
+            self._index_remove(cache_import_id, key)
         import_cache_dir = self._get_cache_path(import_id)
         if exists(import_cache_dir):
             try:
@@ -89,9 +442,194 @@ class CitizensFileCache:
                 self._logger.error(f'Failed delete directory `{import_cache_dir}`', exc_info=True)
 
     def close(self):
+        self.executor.shutdown()
         cache_dir = self._get_cache_path()
         if exists(cache_dir):
             try:
                 shutil.rmtree(cache_dir)
             except FileNotFoundError:
                 self._logger.error(f'Failed delete directory `{cache_dir}`', exc_info=True)
+
+
+class CitizensSharedMemoryCache:
+    """
+    Кеш в разделяемой памяти: файл (по умолчанию в /dev/shm) отображается
+    через mmap во все процессы-воркеры, поэтому после открытия чтение и
+    запись не требуют обращений к файловой системе.
+
+    Файл состоит из заголовка, хеш-таблицы записей фиксированного размера
+    (`max_entries`, открытая адресация) и области данных размером `max_bytes`.
+    Данные пишутся в область по кругу, записи, на место которых пишутся
+    новые данные, вытесняются. Доступ между процессами синхронизируется
+    через `flock`.
+
+    Все процессы должны использовать одинаковые `max_entries` и `max_bytes`,
+    иначе файл будет пересоздан.
+    """
+    executor = None  # чтение и запись - копирование в памяти, их можно делать в loop-е
+    MAGIC = b'CZCACHE1'
+    # magic, max_entries, max_bytes, позиция записи в области данных, номер следующей записи
+    HEADER = struct.Struct('8sQQQQ')
+    KEY_SIZE = 32
+    # state, hash, import_id, key, offset, size, seq
+    SLOT = struct.Struct(f'BxxxIq{KEY_SIZE}sQQQ')
+    SLOT_STATE = struct.Struct('BxxxI')
+    EMPTY, USED, DELETED = 0, 1, 2
+
+    def __init__(self, path=None, max_bytes=256 * 1024 ** 2, max_entries=4096):
+        if path is None:
+            shm_dir = '/dev/shm' if exists('/dev/shm') else '/tmp'
+            path = join(shm_dir, 'citizens.cache')
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._data_offset = self.HEADER.size + self.SLOT.size * max_entries
+        size = self._data_offset + max_bytes
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked(fcntl.LOCK_EX):
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)  # чтобы файл был заполнен нулями
+                os.ftruncate(self._fd, size)
+            self._mmap = mmap.mmap(self._fd, size)
+            magic, *params = self.HEADER.unpack_from(self._mmap, 0)[:3]
+            if magic != self.MAGIC or params != [max_entries, max_bytes]:
+                self._mmap[:self._data_offset] = bytes(self._data_offset)
+                self.HEADER.pack_into(self._mmap, 0, self.MAGIC, max_entries, max_bytes, 0, 0)
+        # NOTE: та же таблица в виде массива, для операций сразу над всеми записями
+        self._slots = np.frombuffer(self._mmap, count=max_entries, offset=self.HEADER.size, dtype=np.dtype({
+            'names': ['state', 'hash', 'import_id', 'key', 'offset', 'size', 'seq'],
+            'formats': ['u1', 'u4', 'i8', f'S{self.KEY_SIZE}', 'u8', 'u8', 'u8'],
+            'offsets': [0, 4, 8, 16, 16 + self.KEY_SIZE, 24 + self.KEY_SIZE, 32 + self.KEY_SIZE],
+            'itemsize': self.SLOT.size,
+        }))
+
+    @contextmanager
+    def _locked(self, operation):
+        fcntl.flock(self._fd, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(import_id, key):
+        return zlib.crc32(b'%d:%s' % (import_id, key))
+
+    def _slot_position(self, index):
+        return self.HEADER.size + self.SLOT.size * index
+
+    def _find(self, import_id, key, key_hash):
+        """Возвращает (индекс, запись) или None."""
+        index = key_hash % self._max_entries
+        for _ in range(self._max_entries):
+            position = self._slot_position(index)
+            state, slot_hash = self.SLOT_STATE.unpack_from(self._mmap, position)
+            if state == self.EMPTY:
+                return None
+            if state == self.USED and slot_hash == key_hash:
+                slot = self.SLOT.unpack_from(self._mmap, position)
+                if slot[2] == import_id and slot[3].rstrip(b'\0') == key:
+                    return index, slot
+            index = (index + 1) % self._max_entries
+        return None
+
+    def _insert(self, slot):
+        index = slot[1] % self._max_entries
+        while self.SLOT_STATE.unpack_from(self._mmap, self._slot_position(index))[0] == self.USED:
+            index = (index + 1) % self._max_entries
+        self.SLOT.pack_into(self._mmap, self._slot_position(index), *slot)
+
+    def _rehash(self):
+        # NOTE: удаленные записи удлиняют поиск, поэтому иногда перестраиваем таблицу
+        slots = self._slots
+        used = slots[slots['state'] == self.USED].copy()
+        slots['state'] = self.EMPTY
+        for slot in used.tolist():
+            self._insert(slot)
+
+    def put(self, import_id, key, data):
+        key = key.encode()
+        size = len(data)
+        if len(key) > self.KEY_SIZE or size > self._max_bytes:
+            return
+        key_hash = self._hash(import_id, key)
+        slots = self._slots
+        with self._locked(fcntl.LOCK_EX):
+            _, _, _, write_pos, seq = self.HEADER.unpack_from(self._mmap, 0)
+            offset = write_pos if write_pos + size <= self._max_bytes else 0
+            # Вытесняем записи, чьи данные будут перезаписаны, и старое значение ключа
+            evicted = (
+                (slots['state'] == self.USED)
+                & (slots['offset'] < offset + size)
+                & (slots['offset'] + slots['size'] > offset)
+            )
+            self._evictions += int(np.count_nonzero(evicted))
+            found = self._find(import_id, key, key_hash)
+            if found is not None:
+                evicted[found[0]] = True
+            slots['state'][evicted] = self.DELETED
+            used = slots['state'] == self.USED
+            if used.all():
+                # NOTE: кончились записи, а не место - вытесняем самую старую
+                slots['state'][np.argmin(slots['seq'])] = self.DELETED
+                self._evictions += 1
+            if np.count_nonzero(slots['state'] == self.EMPTY) < self._max_entries // 4:
+                self._rehash()
+            start = self._data_offset + offset
+            self._mmap[start:start + size] = data
+            self._insert((self.USED, key_hash, import_id, key, offset, size, seq))
+            self.HEADER.pack_into(self._mmap, 0, self.MAGIC, self._max_entries, self._max_bytes,
+                                  offset + size, seq + 1)
+
+    def get(self, import_id, key):
+        key = key.encode()
+        with self._locked(fcntl.LOCK_SH):
+            found = self._find(import_id, key, self._hash(import_id, key))
+            if found is None:
+                self._misses += 1
+                return None
+            _, slot = found
+            start = self._data_offset + slot[4]
+            self._hits += 1
+            return self._mmap[start:start + slot[5]]
+
+    def stats(self):
+        """
+        Количество записей и их суммарный размер - общие для всех процессов,
+        попадания, промахи и вытеснения - только текущего процесса.
+        """
+        slots = self._slots
+        with self._locked(fcntl.LOCK_SH):
+            used = slots['state'] == self.USED
+            return {
+                'entries': int(np.count_nonzero(used)),
+                'bytes': int(slots['size'][used].sum()),
+                'max_entries': self._max_entries,
+                'max_bytes': self._max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+
+    def clear(self, import_id):
+        slots = self._slots
+        with self._locked(fcntl.LOCK_EX):
+            slots['state'][(slots['state'] == self.USED) & (slots['import_id'] == import_id)] = self.DELETED
+
+    def close(self):
+        if self._mmap.closed:
+            return
+        with self._locked(fcntl.LOCK_EX):
+            self._slots['state'] = self.EMPTY
+        # NOTE: mmap нельзя закрыть, пока на него есть ссылки из numpy
+        del self._slots
+        self._mmap.close()
+        os.close(self._fd)
+
+
+CACHE_CLASSES = {
+    cls.__name__: cls
+    for cls in (CitizensFileCache, CitizensSharedMemoryCache)
+}
@@ -0,0 +1,65 @@
+import json
+
+from aiohttp import web
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JsonCodec:
+    """
+    Кодирование и разбор JSON для запросов и ответов. `dumps` сразу
+    возвращает байты, чтобы готовое тело (например, из кеша) не
+    перекодировать. При невалидном JSON `loads` бросает `ValueError`.
+    """
+    name = 'json'
+
+    def dumps(self, data) -> bytes:
+        return json.dumps(data).encode()
+
+    def loads(self, data: bytes):
+        return json.loads(data)
+
+    def response(self, data, status=200):
+        return web.Response(body=self.dumps(data), status=status, content_type='application/json')
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def dumps(self, data) -> bytes:
+        # NOTE: в отчете по месяцам ключи - числа
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data: bytes):
+        return orjson.loads(data)
+
+
+class UjsonCodec(JsonCodec):
+    name = 'ujson'
+
+    def dumps(self, data) -> bytes:
+        return ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False).encode()
+
+    def loads(self, data: bytes):
+        return ujson.loads(data)
+
+
+CODEC_CLASSES = {
+    cls.name: cls
+    for cls, module in ((JsonCodec, json), (OrjsonCodec, orjson), (UjsonCodec, ujson))
+    if module is not None
+}
+
+
+def get_codec(name='json'):
+    if name not in CODEC_CLASSES:
+        raise ValueError(f'Unknown or not installed json codec `{name}`.')
+    return CODEC_CLASSES[name]()
@@ -0,0 +1,147 @@
+import codecs
+import json
+import re
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+class JsonBodyTooLarge(JsonStreamError):
+    def __init__(self, max_size, actual_size):
+        super().__init__(f'Body is too large ({actual_size} > {max_size} bytes).')
+        self.max_size = max_size
+        self.actual_size = actual_size
+
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class BytesStream:
+    """
+    Поток поверх уже прочитанных байт, с тем же `read`, что и у тела запроса.
+    """
+    def __init__(self, data: bytes):
+        self._data = data
+        self._pos = 0
+
+    async def read(self, n):
+        chunk = self._data[self._pos:self._pos + n]
+        self._pos += len(chunk)
+        return chunk
+
+
+class JsonArrayReader:
+    """
+    Читает из потока JSON-объект вида `{"<key>": [...], ...}` и отдаёт
+    элементы массива `key` по одному, по мере того как они приходят.
+
+    Тело запроса целиком в памяти не держим: в буфере лежит только
+    недочитанный хвост (не больше чем `max_item_size` символов на элемент).
+
+    NOTE: разбирает стандартным json, а не `app.codec`: нужен `raw_decode`,
+    который разбирает один элемент с позиции в буфере, а у orjson и ujson
+    его нет.
+    """
+    def __init__(self, stream, key, chunk_size=64 * 1024, max_size=None,
+                 max_item_size=1024 ** 2):
+        self._stream = stream
+        self._key = key
+        self._chunk_size = chunk_size
+        self._max_size = max_size
+        self._max_item_size = max_item_size
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._bytes_read = 0
+        self.key_found = False
+
+    async def _fill(self):
+        data = await self._stream.read(self._chunk_size)
+        self._bytes_read += len(data)
+        if self._max_size is not None and self._bytes_read > self._max_size:
+            raise JsonBodyTooLarge(self._max_size, self._bytes_read)
+        if not data:
+            self._eof = True
+        try:
+            text = self._text_decoder.decode(data, final=self._eof)
+        except UnicodeDecodeError as e:
+            raise JsonStreamError(f'Invalid body encoding. {e}') from e
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+
+    async def _next_char(self):
+        while True:
+            self._pos = WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if self._eof:
+                raise JsonStreamError('Unexpected end of JSON.')
+            await self._fill()
+
+    async def _expect(self, *chars):
+        char = await self._next_char()
+        if char not in chars:
+            expected = ' or '.join(f'`{c}`' for c in chars)
+            raise JsonStreamError(f'{expected} expected at position {self._bytes_read}.')
+        self._pos += 1
+        return char
+
+    async def _read_value(self):
+        await self._next_char()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError as e:
+                if self._eof or len(self._buf) - self._pos > self._max_item_size:
+                    raise JsonStreamError(str(e)) from e
+                await self._fill()
+                continue
+            # NOTE: число в конце буфера может оказаться обрезанным
+            if end == len(self._buf) and not self._eof:
+                await self._fill()
+                continue
+            self._pos = end
+            return value
+
+    async def _read_key(self):
+        await self._next_char()
+        if self._buf[self._pos] != '"':
+            raise JsonStreamError(f'Key expected at position {self._bytes_read}.')
+        key = await self._read_value()
+        await self._expect(':')
+        return key
+
+    async def _read_array(self):
+        await self._expect('[')
+        if await self._next_char() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield await self._read_value()
+            if await self._expect(',', ']') == ']':
+                return
+
+    async def __aiter__(self):
+        await self._expect('{')
+        if await self._next_char() == '}':
+            self._pos += 1
+        else:
+            while True:
+                key = await self._read_key()
+                if key == self._key and not self.key_found:
+                    self.key_found = True
+                    async for item in self._read_array():
+                        yield item
+                else:
+                    await self._read_value()
+                if await self._expect(',', '}') == '}':
+                    break
+        # Убеждаемся, что после объекта ничего нет
+        while not self._eof:
+            await self._fill()
+        self._pos = WHITESPACE.match(self._buf, self._pos).end()
+        if self._pos != len(self._buf):
+            raise JsonStreamError('Extra data after JSON object.')
@@ -0,0 +1,184 @@
+import datetime
+import itertools
+from typing import List, Dict
+
+from citizens import reports
+from citizens.storage import (
+    BaseCitizensStorage, ImportNotFound, CitizenNotFound, RelativeNotFound
+)
+
+
+class _Citizen:
+    __slots__ = ('position', 'keys', 'citizen_id', 'town', 'street', 'building', 'apartment',
+                 'name', 'birth_date', 'gender', 'relatives', 'birth_month', 'birth_year')
+
+    def __init__(self, position, keys, data):
+        self.position = position
+        self.keys = keys
+        self.update(data)
+
+    def update(self, values):
+        for name, value in values.items():
+            if name == 'relatives':
+                value = list(value)
+            setattr(self, name, value)
+        if 'birth_date' in values:
+            self.birth_month, self.birth_year = reports.birth_month_year(self.birth_date)
+
+    def to_dict(self, fields=None):
+        keys = self.keys if fields is None else [k for k in self.keys if k in fields]
+        data = {name: getattr(self, name) for name in keys}
+        if 'relatives' in data:
+            data['relatives'] = list(data['relatives'])
+        return data
+
+
+class _Import:
+    __slots__ = ('citizens', 'index', 'referenced_by', 'presents', 'birth_years', 'version')
+
+    def __init__(self):
+        self.citizens = []  # в порядке импорта
+        self.index = {}  # citizen_id -> _Citizen
+        self.referenced_by = {}  # citizen_id -> множество тех, у кого он в relatives
+        # NOTE: отчеты считаются при импорте, см. citizens.reports
+        self.presents = None
+        self.birth_years = None
+        self.version = 1
+
+    def link(self, citizen_id, relative_id):
+        self.referenced_by.setdefault(relative_id, set()).add(citizen_id)
+
+    def unlink(self, citizen_id, relative_id):
+        referenced_by = self.referenced_by.get(relative_id)
+        if referenced_by is not None:
+            referenced_by.discard(citizen_id)
+            if not referenced_by:
+                del self.referenced_by[relative_id]
+
+    def is_linked(self, citizen_id, relative_id):
+        return citizen_id in self.referenced_by.get(relative_id, ())
+
+    def build_reports(self, citizens):
+        self.presents = reports.count_presents(citizens)
+        self.birth_years = reports.count_birth_years(citizens)
+
+
+class MemoryStorage(BaseCitizensStorage):
+    """
+    Хранит выгрузки в памяти процесса. Данные не разделяются между
+    процессами и пропадают при перезапуске, поэтому подходит для небольших
+    инсталляций с одним процессом и для замеров HTTP-слоя без базы.
+    """
+    def __init__(self, config: dict):
+        self._imports = {}
+        self._import_ids = itertools.count(1)
+        self._keys_cache = {}  # чтобы у всех жителей с одинаковым порядком полей был один кортеж
+
+    def _get_import(self, import_id):
+        citizens_import = self._imports.get(import_id)
+        if citizens_import is None:
+            raise ImportNotFound(f'Import `{import_id}` does not exists.')
+        return citizens_import
+
+    def _get_citizen(self, citizens_import, citizen_id):
+        citizen = citizens_import.index.get(citizen_id)
+        if citizen is None:
+            raise CitizenNotFound(f'Citizen `{citizen_id}` not found.')
+        return citizen
+
+    async def import_citizens(self, citizens: List[Dict]):
+        import_id = next(self._import_ids)
+        citizens_import = _Import()
+        for position, data in enumerate(citizens):
+            keys = tuple(data)
+            keys = self._keys_cache.setdefault(keys, keys)
+            citizen = _Citizen(position, keys, data)
+            citizens_import.citizens.append(citizen)
+            citizens_import.index[citizen.citizen_id] = citizen
+            for rid in citizen.relatives:
+                citizens_import.link(citizen.citizen_id, rid)
+        citizens_import.build_reports(citizens)
+        self._imports[import_id] = citizens_import
+        return import_id
+
+    def _find(self, citizens_import, filter):
+        if not filter:
+            return citizens_import.citizens
+        conditions = {
+            name: set(value) if isinstance(value, list) else {value}
+            for name, value in filter.items()
+        }
+        citizens = citizens_import.citizens
+        citizen_ids = conditions.pop('citizen_id', None)
+        if citizen_ids is not None:
+            index = citizens_import.index
+            found = [index[cid] for cid in citizen_ids if cid in index]
+            citizens = sorted(found, key=lambda citizen: citizen.position)
+        return [
+            citizen for citizen in citizens
+            if all(getattr(citizen, name) in values for name, values in conditions.items())
+        ]
+
+    async def get_citizens(self, import_id: int, filter: dict=None,
+                           return_fields: List[str]=None):
+        citizens_import = self._get_import(import_id)
+        return [citizen.to_dict(return_fields)
+                for citizen in self._find(citizens_import, filter)]
+
+    async def iter_citizens(self, import_id: int, batch_size: int = 1000):
+        citizens = self._get_import(import_id).citizens
+        for i in range(0, len(citizens), batch_size):
+            yield [citizen.to_dict() for citizen in citizens[i:i + batch_size]]
+
+    async def update_citizen(self, import_id: int, citizen_id: int, values: dict):
+        citizens_import = self._get_import(import_id)
+        citizen = self._get_citizen(citizens_import, citizen_id)
+        old_data = citizen.to_dict()
+        new_relatives = values.get('relatives')
+        if new_relatives is not None:
+            old_relatives = set(citizen.relatives)
+            # NOTE: сначала убеждаемся, что все родственники есть, чтобы не
+            # оставить связи обновленными наполовину
+            for rid in itertools.chain(old_relatives, new_relatives):
+                if rid not in citizens_import.index:
+                    raise RelativeNotFound(f'Relative `{rid}` not found.')
+            for rid in old_relatives.difference(new_relatives):
+                citizens_import.unlink(citizen_id, rid)
+                if rid != citizen_id:
+                    if citizens_import.is_linked(rid, citizen_id):
+                        citizens_import.index[rid].relatives.remove(citizen_id)
+                    citizens_import.unlink(rid, citizen_id)
+            for rid in new_relatives:
+                if rid in old_relatives:
+                    continue
+                citizens_import.link(citizen_id, rid)
+                if rid != citizen_id:
+                    if not citizens_import.is_linked(rid, citizen_id):
+                        citizens_import.index[rid].relatives.append(citizen_id)
+                    citizens_import.link(rid, citizen_id)
+        # NOTE: отчеты обновляем только на изменения
+        changed = reports.changed_relatives(citizen_id, old_data['relatives'],
+                                            values.get('relatives', old_data['relatives']))
+        relatives_months = {rid: citizens_import.index[rid].birth_month for rid in changed}
+        citizens_import.presents.update(
+            reports.presents_changes(citizen_id, old_data, values, relatives_months))
+        citizens_import.birth_years.update(reports.birth_years_changes(old_data, values))
+        citizen.update(values)
+        citizens_import.version += 1
+        old_data.update(values)
+        return old_data
+
+    async def get_import_version(self, import_id: int):
+        return self._get_import(import_id).version
+
+    async def get_presents_by_month(self, import_id: int):
+        citizens_import = self._get_import(import_id)
+        return reports.presents_report(citizens_import.presents)
+
+    async def get_ages_by_town(self, import_id: int):
+        citizens_import = self._get_import(import_id)
+        current_year = datetime.datetime.utcnow().date().year
+        return reports.ages_report(citizens_import.birth_years, current_year)
+
+    async def close(self):
+        self._imports.clear()
@@ -0,0 +1,281 @@
+import asyncio
+import bisect
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from os.path import exists, join
+
+from aiohttp import web
+from aiojobs.aiohttp import get_scheduler_from_app
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """
+    Счетчики и гистограммы текущего процесса. Каждый процесс периодически
+    сбрасывает их в свой файл `{metrics_dir}/{pid}.json`, а `/metrics`
+    складывает файлы всех живых процессов, поэтому за supervisor-ом с
+    несколькими процессами отдается общая картина.
+
+    Счетчики и гистограммы умерших процессов переносятся в общий файл
+    `{metrics_dir}/accumulated.json`, чтобы после перезапуска воркера
+    суммы не уменьшались (иначе Prometheus посчитает это сбросом счетчика).
+    """
+    ACCUMULATED = 'accumulated'
+
+    def __init__(self, metrics_dir='/tmp/citizens.metrics', flush_interval=5.0,
+                 buckets=DEFAULT_BUCKETS):
+        self._metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self._buckets = tuple(buckets)
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [counts по корзинам..., +Inf, sum]
+        os.makedirs(metrics_dir, exist_ok=True)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_counter(self, name, value, **labels):
+        """Для счетчиков, которые считаются в другом месте, например вытеснений в кеше."""
+        self._counters[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [0] * (len(self._buckets) + 2)
+        histogram[bisect.bisect_left(self._buckets, value)] += 1
+        histogram[-1] += value
+
+    def snapshot(self, gauges=()):
+        return {
+            'buckets': self._buckets,
+            'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+            'histograms': [[name, labels, values] for (name, labels), values in self._histograms.items()],
+            'gauges': [[name, labels, value] for name, labels, value in gauges],
+        }
+
+    def _get_filepath(self, pid):
+        return join(self._metrics_dir, f'{pid}.json')
+
+    def flush(self, gauges=()):
+        self._write(self._get_filepath(os.getpid()), self.snapshot(gauges))
+
+    def remove(self):
+        """При остановке процесса его счетчики переносятся в накопленные."""
+        with self._accumulated() as accumulated:
+            accumulated.update(self._accumulate(accumulated, self.snapshot()))
+            filepath = self._get_filepath(os.getpid())
+            if exists(filepath):
+                os.unlink(filepath)
+
+    @staticmethod
+    def _read(filepath):
+        try:
+            with open(filepath) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _write(filepath, snapshot):
+        tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+        with open(tmp_filepath, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_filepath, filepath)
+
+    @contextmanager
+    def _accumulated(self):
+        """
+        Накопленный снимок умерших процессов. Изменения сохраняются при выходе,
+        все под блокировкой, чтобы два процесса не учли один файл дважды.
+        """
+        filepath = self._get_filepath(self.ACCUMULATED)
+        with open(join(self._metrics_dir, f'{self.ACCUMULATED}.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            accumulated = self._read(filepath)
+            if accumulated is None or tuple(accumulated['buckets']) != self._buckets:
+                accumulated = {'buckets': self._buckets, 'counters': [], 'histograms': [], 'gauges': []}
+            before = json.dumps(accumulated)
+            yield accumulated
+            if json.dumps(accumulated) != before:
+                self._write(filepath, accumulated)
+
+    def _accumulate(self, accumulated, snapshot):
+        """Складывает счетчики и гистограммы двух снимков."""
+        counters = {}
+        histograms = {}
+        for item in (accumulated, snapshot):
+            if tuple(item['buckets']) != self._buckets:
+                continue
+            for name, labels, value in item['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in item['histograms']:
+                total = histograms.setdefault((name, tuple(map(tuple, labels))), [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+        return {
+            'buckets': self._buckets,
+            'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'histograms': [[name, labels, values] for (name, labels), values in histograms.items()],
+            'gauges': [],
+        }
+
+    def _load_snapshots(self):
+        """
+        Возвращает [(pid, snapshot)] живых процессов и накопленный снимок
+        умерших (с pid `accumulated`), в который переносятся файлы процессов,
+        завершившихся без `remove`.
+        """
+        snapshots = []
+        with self._accumulated() as accumulated:
+            for filename in os.listdir(self._metrics_dir):
+                name, ext = os.path.splitext(filename)
+                if ext != '.json' or not name.isdigit():
+                    continue
+                pid = int(name)
+                filepath = join(self._metrics_dir, filename)
+                snapshot = self._read(filepath)
+                if snapshot is None:
+                    continue
+                if _is_alive(pid):
+                    snapshots.append((pid, snapshot))
+                    continue
+                accumulated.update(self._accumulate(accumulated, snapshot))
+                os.unlink(filepath)
+            snapshots.append((self.ACCUMULATED, dict(accumulated)))
+        return snapshots
+
+    def render(self):
+        """Метрики всех процессов в текстовом формате Prometheus."""
+        counters = {}
+        histograms = {}
+        gauges = {}
+        buckets = self._buckets
+        for pid, snapshot in self._load_snapshots():
+            if tuple(snapshot['buckets']) != buckets:
+                continue
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+            for name, labels, value in snapshot['gauges']:
+                # NOTE: значения гаугов у каждого процесса свои
+                gauges[(name, tuple(map(tuple, labels)) + (('pid', str(pid)),))] = value
+        lines = []
+        for metric_type, metrics in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({name for name, _ in metrics}):
+                lines.append(f'# TYPE {name} {metric_type}')
+                for (metric_name, labels), value in sorted(metrics.items()):
+                    if metric_name == name:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f'# TYPE {name} histogram')
+            for (metric_name, labels), values in sorted(histograms.items()):
+                if metric_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), values[:-1]):
+                    cumulative += count
+                    le = (('le', str(bound)),)
+                    lines.append(f'{name}_bucket{_format_labels(labels + le)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {values[-1]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    values = ','.join(
+        '{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    )
+    return '{' + values + '}'
+
+
+def _collect(app):
+    """Обновляет счетчики, которые считаются вне метрик, и возвращает гауги."""
+    gauges = []
+    scheduler = get_scheduler_from_app(app)
+    if scheduler is not None:
+        gauges.append(('citizens_jobs_active', (), scheduler.active_count))
+        gauges.append(('citizens_jobs_pending', (), scheduler.pending_count))
+    queue_size = getattr(app.storage, 'executor_queue_size', None)
+    if queue_size is not None:
+        gauges.append(('citizens_storage_executor_queue_size', (), queue_size()))
+    if hasattr(app, 'cache'):
+        stats = app.cache.stats()
+        gauges.append(('citizens_cache_entries', (), stats['entries']))
+        gauges.append(('citizens_cache_bytes', (), stats['bytes']))
+        app.metrics.set_counter('citizens_cache_evictions_total', stats['evictions'])
+    return gauges
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    t1 = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        route = request.match_info.route.resource
+        route = route.canonical if route is not None else 'unknown'
+        request.app.metrics.observe('citizens_request_duration_seconds', time.perf_counter() - t1,
+                                    route=route, method=request.method, status=str(status))
+
+
+async def metrics_handler(request):
+    app = request.app
+    app.metrics.flush(_collect(app))
+    return web.Response(text=app.metrics.render(), content_type='text/plain', charset='utf-8')
+
+
+async def _flush_periodically(app):
+    while True:
+        await asyncio.sleep(app.metrics.flush_interval)
+        app.metrics.flush(_collect(app))
+
+
+async def __startup(app):
+    app.metrics_flusher = asyncio.ensure_future(_flush_periodically(app))
+
+
+async def __shutdown(app):
+    app.metrics_flusher.cancel()
+    app.metrics.remove()
+
+
+def citizens_metrics_setup(app, config=None):
+    app.metrics = Metrics(**(config or {}))
+    app.router.add_get('/metrics', metrics_handler)
+    app.on_startup.append(__startup)
+    app.on_shutdown.append(__shutdown)
@@ -0,0 +1,173 @@
+import asyncio
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from citizens.codec import JsonCodec, get_codec
+from citizens.schema import CitizensValidator, DataValidationError
+
+
+# NOTE: разбиваем только тело ровно такого вида, всё остальное проверяется как обычно
+CITIZENS_ARRAY = re.compile(rb'\s*\{\s*"citizens"\s*:\s*\[(.*)\]\s*\}\s*', re.DOTALL)
+# Граница между соседними жителями
+CITIZENS_SEPARATOR = re.compile(rb'\}\s*,\s*\{')
+
+
+class SharedBody:
+    """
+    Тело запроса в разделяемой памяти: процессы пула читают свои куски
+    прямо из нее, сами куски не копируются и не передаются через pickle.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.name = self._shm.name
+        self.view = self._shm.buf[:size]
+
+    def close(self):
+        self.view.release()
+        self._shm.close()
+        self._shm.unlink()
+
+
+async def read_shared_body(content, size: int):
+    """Читает тело запроса известного размера сразу в разделяемую память."""
+    body = SharedBody(size)
+    pos = 0
+    try:
+        async for data in content.iter_any():
+            body.view[pos:pos + len(data)] = data
+            pos += len(data)
+    except BaseException:
+        body.close()
+        raise
+    return body
+
+
+def split_citizens(body, parts: int):
+    """
+    Делит тело `{"citizens": [...]}` примерно на `parts` кусков по границам
+    между жителями. Возвращает список диапазонов (start, end): каждый кусок -
+    это элементы массива через запятую, без скобок. Если тело другого вида,
+    возвращает None.
+
+    Граница ищется без разбора JSON, поэтому может попасть внутрь строки
+    или вложенного значения. Тогда хотя бы один кусок не разберется как
+    JSON, и это обнаружится уже при разборе кусков.
+    """
+    matched = CITIZENS_ARRAY.fullmatch(body)
+    if matched is None:
+        return None
+    start, end = matched.span(1)
+    step = max((end - start) // parts, 1)
+    ranges = []
+    while True:
+        separator = None
+        if start + step < end:
+            separator = CITIZENS_SEPARATOR.search(body, start + step, end)
+        if separator is None:
+            ranges.append((start, end))
+            return ranges
+        ranges.append((start, separator.start() + 1))
+        start = separator.end() - 1
+
+
+def split_shared(shm_name: str, size: int, parts: int):
+    """Выполняется в процессе пула: `split_citizens` для тела в разделяемой памяти."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        body = shm.buf[:size]
+        try:
+            return split_citizens(body, parts)
+        finally:
+            body.release()
+    finally:
+        shm.close()
+
+
+def validate_chunk(shm_name: str, start: int, end: int, codec_name: str = JsonCodec.name):
+    """
+    Выполняется в процессе пула. Разбирает и проверяет кусок тела из
+    разделяемой памяти, не проверяя родственные связи. Возвращает жителей
+    куска (None, если нашлась ошибка), состояние проверки и ошибку. Если
+    кусок не JSON-массив, возвращает None.
+    """
+    # NOTE: процессы пула (spawn) делят resource_tracker с основным процессом,
+    # он и удалит память
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        chunk = b'[' + bytes(shm.buf[start:end]) + b']'
+    finally:
+        shm.close()
+    try:
+        citizens = get_codec(codec_name).loads(chunk)
+    except ValueError:
+        return None
+    if not isinstance(citizens, list):
+        return None
+    validator = CitizensValidator()
+    try:
+        validator.validate_many(citizens)
+    except DataValidationError as e:
+        return None, validator, str(e)
+    return citizens, validator, None
+
+
+class ParallelImportValidator:
+    """
+    Разбирает и проверяет большие выгрузки в пуле процессов, чтобы не
+    занимать loop и использовать все ядра. Тело лежит в разделяемой памяти,
+    процессы получают только диапазоны своих кусков и возвращают жителей
+    куска. Куски небольшие (`chunk_size`), поэтому loop ждет не дольше,
+    чем распаковывается результат одного куска. В текущем процессе
+    остается только проверка родственных связей, для нее нужны все
+    жители сразу.
+    """
+    def __init__(self, config: dict, codec: JsonCodec = None):
+        # NOTE: процессов сервиса на машине обычно несколько (`workers`, как
+        # numprocs в supervisor), у каждого свой пул, поэтому ядра делим между ними
+        processes = config.get('processes') or max(os.cpu_count() // config.get('workers', 1), 1)
+        # NOTE: spawn, а не fork: в процессе уже есть потоки (например, у хранилища)
+        self._executor = ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context('spawn'))
+        # Кусков больше, чем процессов, чтобы процессы нагружались равномерно
+        self._min_parts = processes * config.get('chunks_per_process', 4)
+        self._chunk_size = config.get('chunk_size', 256 * 1024)
+        self.min_size = config.get('min_size', 4 * 1024 ** 2)
+        # NOTE: в процессы пула передаем имя кодека, кодек создается там
+        self._codec_name = (codec or JsonCodec()).name
+
+    async def validate(self, body: SharedBody):
+        """
+        Возвращает список жителей или бросает `DataValidationError` с той же
+        ошибкой, что и проверка по одному. Если тело не удалось разбить на
+        куски, возвращает None - тогда его нужно проверить как обычно.
+        """
+        loop = asyncio.get_event_loop()
+        parts = max(self._min_parts, body.size // self._chunk_size)
+        ranges = await loop.run_in_executor(self._executor, split_shared, body.name, body.size, parts)
+        if ranges is None:
+            return None
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, validate_chunk, body.name, start, end, self._codec_name)
+            for start, end in ranges
+        ))
+        if any(result is None for result in results):
+            return None
+        citizens = []
+        validator = CitizensValidator()
+        for chunk_citizens, chunk_validator, error in results:
+            validator.merge(chunk_validator)
+            if error is not None:
+                # NOTE: id мог повториться в одном из предыдущих кусков,
+                # при проверке по одному эта ошибка была бы первой
+                validator.check_unique()
+                raise DataValidationError(error)
+            citizens.extend(chunk_citizens)
+        await loop.run_in_executor(None, validator.finish)
+        return citizens
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,120 @@
+import bisect
+import itertools
+import math
+from collections import Counter
+from typing import Dict, List
+
+
+def birth_month_year(birth_date: str):
+    _, month, year = birth_date.split('.')
+    return int(month), int(year)
+
+
+def count_presents(citizens: List[Dict]) -> Counter:
+    """
+    Считает подарки: (месяц, citizen_id) -> сколько родственников
+    жителя `citizen_id` родились в этом месяце.
+    """
+    presents = Counter()
+    for citizen in citizens:
+        month, _ = birth_month_year(citizen['birth_date'])
+        for relative_id in citizen['relatives']:
+            presents[month, relative_id] += 1
+    return presents
+
+
+def changed_relatives(citizen_id: int, old_relatives: List[int], new_relatives: List[int]):
+    """Родственники, у которых при обновлении жителя меняется список relatives."""
+    return set(old_relatives).symmetric_difference(new_relatives) - {citizen_id}
+
+
+def presents_changes(citizen_id: int, old_data: Dict, values: Dict,
+                     relatives_months: Dict[int, int]) -> Dict:
+    """
+    Изменения результата `count_presents` при обновлении жителя: старые
+    данные `old_data`, новые значения `values`. Для родственников из
+    `changed_relatives` в `relatives_months` нужен месяц их рождения.
+    """
+    old_relatives = old_data['relatives']
+    new_relatives = values.get('relatives', old_relatives)
+    old_month, _ = birth_month_year(old_data['birth_date'])
+    new_month, _ = birth_month_year(values.get('birth_date', old_data['birth_date']))
+    changes = Counter()
+    # Подарки, которые родственники покупают самому жителю
+    for relative_id in old_relatives:
+        changes[old_month, relative_id] -= 1
+    for relative_id in new_relatives:
+        changes[new_month, relative_id] += 1
+    # Подарки, которые житель покупает добавленным и удаленным родственникам
+    for relative_id in changed_relatives(citizen_id, old_relatives, new_relatives):
+        changes[relatives_months[relative_id], citizen_id] += 1 if relative_id in new_relatives else -1
+    return {key: delta for key, delta in changes.items() if delta}
+
+
+def count_birth_years(citizens: List[Dict]) -> Counter:
+    """Считает жителей по городам и годам рождения: (город, год) -> количество."""
+    birth_years = Counter()
+    for citizen in citizens:
+        _, year = birth_month_year(citizen['birth_date'])
+        birth_years[citizen['town'], year] += 1
+    return birth_years
+
+
+def birth_years_changes(old_data: Dict, values: Dict) -> Dict:
+    """Изменения результата `count_birth_years` при обновлении жителя."""
+    _, old_year = birth_month_year(old_data['birth_date'])
+    _, new_year = birth_month_year(values.get('birth_date', old_data['birth_date']))
+    old_key = (old_data['town'], old_year)
+    new_key = (values.get('town', old_data['town']), new_year)
+    if old_key == new_key:
+        return {}
+    return {old_key: -1, new_key: 1}
+
+
+def presents_report(presents: Dict) -> List[Dict]:
+    """Отчет в формате `get_presents_by_month` по результату `count_presents`."""
+    report = []
+    for (month, citizen_id), count in sorted(presents.items()):
+        if not count:
+            continue
+        if not report or report[-1]['month'] != month:
+            report.append({'month': month, 'citizens': []})
+        report[-1]['citizens'].append({'citizen_id': citizen_id, 'presents': count})
+    return report
+
+
+def ages_report(birth_years: Dict, current_year: int) -> List[Dict]:
+    """
+    Отчет в формате `get_ages_by_town` по результату `count_birth_years`:
+    для каждого города гистограмма возрастов {возраст: количество жителей}.
+    """
+    report = []
+    for (town, year), count in sorted(birth_years.items()):
+        if not count:
+            continue
+        if not report or report[-1]['town'] != town:
+            report.append({'town': town, 'ages': {}})
+        report[-1]['ages'][current_year - year] = count
+    return report
+
+
+def percentile(histogram: Dict[int, int], q: float) -> float:
+    """
+    То же, что `np.percentile` с линейной интерполяцией по всем значениям,
+    но по гистограмме {значение: количество}, без разворачивания в массив.
+    Вычисления повторяют numpy, чтобы результат совпадал до бита.
+    """
+    values = sorted(value for value, count in histogram.items() if count)
+    cumulative = list(itertools.accumulate(histogram[value] for value in values))
+    n = cumulative[-1]
+    position = (n - 1) * (q / 100)
+    lower = math.floor(position)
+    gamma = position - lower
+    # Значение с индексом k в отсортированном массиве
+    value_at = lambda k: values[bisect.bisect_right(cumulative, k)]
+    a = value_at(lower)
+    b = value_at(min(lower + 1, n - 1))
+    diff = b - a
+    if gamma >= 0.5:
+        return b - diff * (1 - gamma)
+    return a + diff * gamma
@@ -1,6 +1,9 @@
+import array
 import datetime
 import re
 
+import numpy as np
+
 
 class DataValidationError(Exception):
     pass
@@ -14,22 +17,91 @@ class FieldValidationError(SchemaValidationError):
     pass
 
 
+class BatchValidationError(FieldValidationError):
+    def __init__(self, message, index):
+        super().__init__(message)
+        self.index = index
+
+
+BIRTH_DATE_REGEX = re.compile(r'^(?P<day>\d\d?)\.(?P<month>\d\d?)\.(?P<year>\d{4})$')
+
+
+def _type_error(expected_type, value):
+    return 'invalid type (`{expected}` expected, got `{got}`)'.format(
+        expected = expected_type.__name__, got = type(value).__name__)
+
+
 class Field:
+    # NOTE: True, если часть проверок поле умеет делать сразу для всего
+    # списка значений (`validate_batch`), а не по одному
+    batch_validated = False
+
     def validate(self, value):
         pass
 
+    def validate_batch(self, values: list):
+        """
+        Проверяет сразу список значений. Если есть некорректное, бросает
+        `BatchValidationError` с индексом первого такого значения.
+        """
+        for index, value in enumerate(values):
+            try:
+                self.validate(value)
+            except FieldValidationError as e:
+                raise BatchValidationError(str(e), index)
+
+    def compile(self, var, namespace):
+        """
+        Возвращает строки кода, которые проверяют значение переменной `var`
+        так же, как `validate`. Нужные им объекты кладутся в `namespace`.
+        По умолчанию просто вызывается `validate`.
+        """
+        ref = f'_field_{id(self)}'
+        namespace[ref] = self
+        return [f'{ref}.validate({var})']
+
+    def compile_without_batch(self, var, namespace):
+        """
+        То же, что `compile`, но без проверок, которые делает `validate_batch`.
+        """
+        return self.compile(var, namespace)
+
     def _check_type(self, value, expected_type):
         if not isinstance(value, expected_type):
-            message = 'invalid type (`{expected}` expected, got `{got}`)'.format(
-                expected = expected_type.__name__, got = type(value).__name__)
-            raise FieldValidationError(message)
+            raise FieldValidationError(_type_error(expected_type, value))
+
+    def _compile_check_type(self, var, expected_type, namespace):
+        ref = f'_type_{expected_type.__name__}'
+        namespace[ref] = expected_type
+        return [
+            f'if not isinstance({var}, {ref}):',
+            f'    raise FieldValidationError(_type_error({ref}, {var}))',
+        ]
 
 
 class PositiveInteger(Field):
+    def __init__(self, max_value=None):
+        self._max_value = max_value
+
     def validate(self, value):
         self._check_type(value, int)
         if value <= 0:
             raise FieldValidationError('value must be > 0')
+        if self._max_value is not None and value > self._max_value:
+            raise FieldValidationError(f'value must be <= {self._max_value}')
+
+    def compile(self, var, namespace):
+        lines = self._compile_check_type(var, int, namespace) + [
+            f'if {var} <= 0:',
+            '    raise FieldValidationError(\'value must be > 0\')',
+        ]
+        if self._max_value is not None:
+            message = f'value must be <= {self._max_value}'
+            lines += [
+                f'if {var} > {self._max_value!r}:',
+                f'    raise FieldValidationError({message!r})',
+            ]
+        return lines
 
 
 class String(Field):
@@ -57,12 +129,101 @@ class String(Field):
             message = f'unexpected value `{value}`. Expected values: {possible_values}'
             raise FieldValidationError(message)
 
+    def compile(self, var, namespace):
+        lines = self._compile_check_type(var, str, namespace)
+        min_length = self._min_length
+        max_length = self._max_length
+        if min_length > 0:
+            message = f'too short value. Minimum {min_length} symbols expected'
+            lines += [
+                f'if len({var}) < {min_length!r}:',
+                f'    raise FieldValidationError({message!r})',
+            ]
+        if max_length is not None:
+            message = f'too long value. Maximum {max_length} symbols expected'
+            lines += [
+                f'if len({var}) > {max_length!r}:',
+                f'    raise FieldValidationError({message!r})',
+            ]
+        if self._letter_or_digit_required:
+            lines += [
+                f'for char in {var}:',
+                '    if char.isalpha() or char.isdigit():',
+                '        break',
+                'else:',
+                '    raise FieldValidationError(\'at least one digit or letter required\')',
+            ]
+        if self._values:
+            values = tuple(self._values)
+            suffix = '`. Expected values: ' + ', '.join(values)
+            lines += [
+                f'if {var} not in {values!r}:',
+                f'    raise FieldValidationError(\'unexpected value `\' + {var} + {suffix!r})',
+            ]
+        return lines
+
+
+# Количество дней в месяце невисокосного года, индекс - номер месяца
+DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def _suspicious_birth_dates(values: list, today: datetime.date):
+    """
+    Разбирает все даты `dd.mm.yyyy` разом векторными операциями numpy и
+    возвращает индексы тех, что не прошли проверку (по возрастанию).
+
+    Проверка строже, чем `BirthDate.validate` (например, понимает только
+    ASCII-цифры), поэтому найденные значения надо перепроверить по одному.
+    Зато корректное значение здесь не пропускается никогда.
+    """
+    # NOTE: строк длиннее 10 символов в корректной дате не бывает,
+    # 11-й символ нужен только чтобы такие строки не обрезались до корректных
+    width = 11
+    arr = np.array(values, dtype=f'U{width}')
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    codes = arr.view(np.uint32).reshape(len(values), width).astype(np.int64)
+    digits = codes - ord('0')
+    is_digit = (digits >= 0) & (digits <= 9)
+    is_dot = codes == ord('.')
+    rows = np.arange(len(values))
+    # Формат: 1-2 цифры, точка, 1-2 цифры, точка, 4 цифры
+    first_dot = np.where(is_dot[:, 1], 1, 2)
+    second_dot = np.clip(lengths - 5, 0, width - 1)
+    valid = (
+        (lengths >= 8) & (lengths <= 10)
+        # NOTE: numpy отбрасывает \x00 в конце строки, такие длины не совпадут
+        & (np.char.str_len(arr) == lengths)
+        & (is_dot.sum(axis=1) == 2)
+        & (is_digit.sum(axis=1) == lengths - 2)
+        & is_dot[rows, first_dot]
+        & is_dot[rows, second_dot]
+        & (second_dot - first_dot - 1 >= 1) & (second_dot - first_dot - 1 <= 2)
+    )
+    day = np.where(first_dot == 1, digits[:, 0], digits[:, 0] * 10 + digits[:, 1])
+    month_start = first_dot + 1
+    month = np.where(second_dot - first_dot == 2, digits[rows, month_start],
+                     digits[rows, month_start] * 10 + digits[rows, np.minimum(month_start + 1, width - 1)])
+    year = np.zeros(len(values), dtype=np.int64)
+    for offset in range(1, 5):
+        year = year * 10 + digits[rows, np.clip(second_dot + offset, 0, width - 1)]
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    days_in_month = DAYS_IN_MONTH[np.clip(month, 0, 12)] + ((month == 2) & leap)
+    today_value = today.year * 10000 + today.month * 100 + today.day
+    valid &= (
+        (year >= datetime.MINYEAR)
+        & (month >= 1) & (month <= 12)
+        & (day >= 1) & (day <= days_in_month)
+        & (year * 10000 + month * 100 + day < today_value)
+    )
+    return np.flatnonzero(~valid)
+
 
 class BirthDate(String):
+    batch_validated = True
+
     def validate(self, value):
         super().validate(value)
-        regex = re.compile(r'^(?P<day>\d\d?)\.(?P<month>\d\d?)\.(?P<year>\d{4})$')
-        matched = regex.match(value)
+        matched = BIRTH_DATE_REGEX.match(value)
         if not matched:
             raise FieldValidationError('invalid format. `dd.mm.yyyy` expected')
         try:
@@ -75,6 +236,41 @@ class BirthDate(String):
         if date >= today:
             raise FieldValidationError('value must be earlier than today')
 
+    def compile(self, var, namespace):
+        namespace.update(BIRTH_DATE_REGEX=BIRTH_DATE_REGEX, datetime=datetime)
+        return super().compile(var, namespace) + [
+            f'matched = BIRTH_DATE_REGEX.match({var})',
+            'if not matched:',
+            '    raise FieldValidationError(\'invalid format. `dd.mm.yyyy` expected\')',
+            'try:',
+            '    day, month, year = matched.groups()',
+            '    date = datetime.date(int(year), int(month), int(day))',
+            'except Exception as e:',
+            '    raise FieldValidationError(str(e))',
+            'if date >= datetime.datetime.utcnow().date():',
+            '    raise FieldValidationError(\'value must be earlier than today\')',
+        ]
+
+    def compile_without_batch(self, var, namespace):
+        # Формат и сама дата проверяются в `validate_batch`, здесь только то, что это строка
+        return super().compile(var, namespace)
+
+    def validate_batch(self, values: list):
+        """
+        Проверяет все даты разом относительно одного "сегодня". Значения,
+        которые numpy счёл некорректными, перепроверяются по одному через
+        `validate`, чтобы сообщение об ошибке было тем же.
+        Все значения уже должны быть строками.
+        """
+        if not values:
+            return
+        today = datetime.datetime.utcnow().date()
+        for index in _suspicious_birth_dates(values, today):
+            try:
+                self.validate(values[index])
+            except FieldValidationError as e:
+                raise BatchValidationError(str(e), int(index))
+
 
 class List(Field):
     def __init__(self, element_type, unique=False):
@@ -90,9 +286,35 @@ class List(Field):
         if self._unique and len(values) != len(set(values)):
             raise FieldValidationError('elements must be unique')
 
+    def compile(self, var, namespace):
+        lines = self._compile_check_type(var, list, namespace)
+        element_var = f'{var}_element'
+        if isinstance(self._element_type, Field):
+            element_lines = self._element_type.compile(element_var, namespace)
+        else:
+            ref = f'_type_{self._element_type.__name__}'
+            namespace[ref] = self._element_type
+            element_lines = [
+                f'if not isinstance({element_var}, {ref}):',
+                '    raise FieldValidationError(\'invalid element type\')',
+            ]
+        lines.append(f'for {element_var} in {var}:')
+        lines += ['    ' + line for line in element_lines]
+        if self._unique:
+            lines += [
+                f'if len({var}) != len(set({var})):',
+                '    raise FieldValidationError(\'elements must be unique\')',
+            ]
+        return lines
+
+
+# NOTE: id жителей проверяем на массивах int64 (см. CitizensValidator),
+# да и mongodb больше 8-байтных целых не хранит
+MAX_CITIZEN_ID = 2 ** 63 - 1
+
 
 class CitizenSchema:
-    citizen_id = PositiveInteger()
+    citizen_id = PositiveInteger(max_value=MAX_CITIZEN_ID)
     town = String(letter_or_digit_required=True, max_length=256)
     street = String(letter_or_digit_required=True, max_length=256)
     building = String(letter_or_digit_required=True, max_length=256)
@@ -100,56 +322,207 @@ class CitizenSchema:
     name = String(min_length=1, max_length=256)
     birth_date = BirthDate()
     gender = String(values=('male', 'female'))
-    relatives = List(element_type=PositiveInteger(), unique=True)
+    relatives = List(element_type=PositiveInteger(max_value=MAX_CITIZEN_ID), unique=True)
 
     def __new__(cls, *args, **kwargs):
         obj = super().__new__(cls, *args, **kwargs)
         fields = {k: v for k, v in cls.__dict__.items() if isinstance(v, Field)}
         obj.fields = fields
         obj.fields_cnt = len(fields)
+        # NOTE: компилируем один раз на класс, а не на каждый объект
+        if '_compiled_validate' not in cls.__dict__:
+            cls._compiled_validate = staticmethod(cls._compile(fields))
+            cls._compiled_validate_without_batch = staticmethod(cls._compile(fields, without_batch=True))
+        obj.batch_fields = [name for name, field in fields.items() if field.batch_validated]
         return obj
 
+    @staticmethod
+    def _compile(fields, without_batch=False):
+        """
+        Собирает одну функцию проверки, в которой проверки всех полей
+        встроены в код, без вызовов `Field.validate` на каждое значение.
+        Порядок проверок и сообщения об ошибках те же, что и в `Field.validate`.
+        С `without_batch` пропускаются проверки, которые делает `Field.validate_batch`.
+        """
+        namespace = {
+            'FieldValidationError': FieldValidationError,
+            'SchemaValidationError': SchemaValidationError,
+            '_type_error': _type_error,
+        }
+        lines = [
+            'def validate(data, partial=False):',
+            '    try:',
+            '        for name, value in data.items():',
+        ]
+        condition = 'if'
+        for name, field in fields.items():
+            lines.append(f'            {condition} name == {name!r}:')
+            if without_batch:
+                field_lines = field.compile_without_batch('value', namespace)
+            else:
+                field_lines = field.compile('value', namespace)
+            lines += ['                ' + line for line in field_lines]
+            condition = 'elif'
+        lines += [
+            '            else:',
+            '                raise SchemaValidationError(\'unknown field\')',
+            f'        if not partial and len(data) != {len(fields)}:',
+            '            raise SchemaValidationError(\'all fields required\')',
+            '    except FieldValidationError as e:',
+            '        err = str(e)',
+            '        raise SchemaValidationError(f\'Field `{name}` is invalid: {err}\')',
+        ]
+        exec('\n'.join(lines), namespace)
+        return namespace['validate']
+
     def validate(self, data: dict, partial=False):
+        self._compiled_validate(data, partial)
+
+    def validate_without_batch(self, data: dict):
+        """
+        Проверяет запись без проверок, которые делаются пачкой. Для полных
+        записей, после него обязательно нужен `validate_batch`.
+        """
+        self._compiled_validate_without_batch(data)
+
+    def validate_batch(self, items: list):
+        """
+        Доделывает пачкой проверки, пропущенные в `validate_without_batch`,
+        для всех записей списка. Ошибка та же, что дал бы `validate` для
+        первой некорректной записи, в `index` - номер этой записи в списке.
+        """
+        errors = []
+        for name in self.batch_fields:
+            try:
+                self.fields[name].validate_batch([data[name] for data in items])
+            except BatchValidationError as e:
+                errors.append((e.index, name, e))
+        if errors:
+            index, name, error = min(errors, key=lambda error: error[0])
+            raise BatchValidationError(f'Field `{name}` is invalid: {error}', index)
+
+
+class CitizensValidator:
+    """
+    Проверяет жителей по одному, по мере поступления. Уникальность id и
+    родственные связи можно проверить только когда все жители получены,
+    поэтому в конце нужно обязательно вызвать `finish`.
+
+    Для этих проверок хранятся только плоские массивы чисел: id жителей
+    в порядке импорта и id их родственников подряд, без объекта на жителя.
+    """
+    def __init__(self):
+        self._schema = CitizenSchema()
+        self._citizen_ids = array.array('q')
+        self._relatives = array.array('q')  # родственники всех жителей подряд
+        self._relatives_cnt = array.array('q')  # сколько из них у каждого жителя
+
+    def validate(self, citizen: dict):
         try:
-            fields = self.fields
-            for name, value in data.items():
-                if name not in fields:
-                    raise SchemaValidationError(f'unknown field')
-                fields[name].validate(value)
-            if not partial and self.fields_cnt != len(data):
-                raise SchemaValidationError('all fields required')
-        except FieldValidationError as e:
-            err = str(e)
-            raise SchemaValidationError(f'Field `{name}` is invalid: {err}')
+            self._schema.validate(citizen)
+        except SchemaValidationError:
+            self._check_unique(len(self._citizen_ids))
+            raise
+        self._add(citizen)
 
+    def validate_many(self, citizens: list):
+        """
+        То же, что `validate` для каждого жителя, но часть проверок
+        (например, дата рождения) делается сразу для всего списка.
+        """
+        schema = self._schema
+        start = len(self._citizen_ids)
+        # NOTE: при ошибке сначала доделываем проверки предыдущих жителей,
+        # чтобы ошибка была той же, что при проверке по одному
+        for index, citizen in enumerate(citizens):
+            try:
+                schema.validate_without_batch(citizen)
+            except SchemaValidationError:
+                self._validate_batch(citizens[:index], start)
+                self._check_unique(start + index)
+                schema.validate(citizen)
+                raise
+            self._add(citizen)
+        self._validate_batch(citizens, start)
 
-def validate_citizens(citizens: list):
-    relatives_by_cid = {}
-    non_existent_relatives = set()
-    schema = CitizenSchema()
-    for citizen in citizens:
-        schema.validate(citizen)
-        cid = citizen['citizen_id']
-        # Если уже встречали этот id, значит он не уникальный в этой выборке
-        if cid in relatives_by_cid:
+    def _validate_batch(self, citizens, start):
+        try:
+            self._schema.validate_batch(citizens)
+        except BatchValidationError as e:
+            # NOTE: жители после ошибочного не считаются проверенными
+            self._truncate(start + e.index)
+            self.check_unique()
+            raise
+
+    def _truncate(self, count):
+        removed_relatives = sum(self._relatives_cnt[count:])
+        del self._relatives[len(self._relatives) - removed_relatives:]
+        del self._relatives_cnt[count:]
+        del self._citizen_ids[count:]
+
+    def _add(self, citizen: dict):
+        relatives = citizen['relatives']
+        self._citizen_ids.append(citizen['citizen_id'])
+        self._relatives.extend(relatives)
+        self._relatives_cnt.append(len(relatives))
+
+    def merge(self, other: 'CitizensValidator'):
+        """
+        Добавляет жителей, уже проверенных другим валидатором (например, в
+        другом процессе), как будто они пришли следом за текущими.
+        """
+        self._citizen_ids.extend(other._citizen_ids)
+        self._relatives.extend(other._relatives)
+        self._relatives_cnt.extend(other._relatives_cnt)
+
+    def check_unique(self):
+        self._check_unique(len(self._citizen_ids))
+
+    def _check_unique(self, count):
+        """
+        Проверяет, что у первых `count` жителей id не повторяются. Ошибка -
+        про первого жителя, чей id уже встречался раньше.
+        """
+        citizen_ids = np.frombuffer(self._citizen_ids, dtype=np.int64)[:count]
+        order = np.argsort(citizen_ids, kind='stable')
+        repeated = citizen_ids[order[1:]] == citizen_ids[order[:-1]]
+        if repeated.any():
+            # NOTE: сортировка устойчивая, поэтому order[1:][repeated] - это
+            # позиции повторов, а не первых вхождений
+            cid = citizen_ids[order[1:][repeated].min()]
             raise DataValidationError(f'Non unique citizen_id `{cid}`')
-        relatives_by_cid[cid] = set(citizen['relatives'])
-        # Собираем id родственников, которых еще не встречали в выборке.
-        # Потенциально их может не оказаться вообще
-        non_seen_relatives = filter(lambda rid: rid not in relatives_by_cid,
-                                    citizen['relatives'])
-        non_existent_relatives.update(non_seen_relatives)
-        # Удаляем текущий cid из множества несуществующих родственников (если есть)
-        if cid in non_existent_relatives:
-            non_existent_relatives.remove(cid)
-
-    # Если после перебора всех жителей у нас остались не найденные родственники, ошибка
-    if non_existent_relatives:
-        cnt = len(non_existent_relatives)
-        raise DataValidationError(f'There are {cnt} non existent relatives')
-    # Проверяем родственные связи. Второй раз проходим по всем. TODO: подумать
-    # может всё-таки как-то можно ужать в один проход?
-    for cid, relatives in relatives_by_cid.items():
-        for relative_cid in relatives:
-            if cid not in relatives_by_cid[relative_cid]:
-                raise DataValidationError(f'Invalid relatives for `{cid}`')
+
+    def finish(self):
+        self.check_unique()
+        citizen_ids = np.frombuffer(self._citizen_ids, dtype=np.int64)
+        relatives = np.frombuffer(self._relatives, dtype=np.int64)
+        # Номер (позиция в импорте) жителя для каждой связи жителя с родственником
+        citizens = np.repeat(np.arange(len(citizen_ids)),
+                             np.frombuffer(self._relatives_cnt, dtype=np.int64))
+        order = np.argsort(citizen_ids)
+        sorted_ids = citizen_ids[order]
+        found = np.searchsorted(sorted_ids, relatives)
+        found[found == len(sorted_ids)] = 0
+        exists = sorted_ids[found] == relatives
+        # Если у нас есть не найденные родственники, ошибка
+        if not exists.all():
+            cnt = len(np.unique(relatives[~exists]))
+            raise DataValidationError(f'There are {cnt} non existent relatives')
+        # Проверяем родственные связи: для каждой пары (житель, родственник)
+        # должна быть и обратная. Пары упаковываем в одно число по номерам жителей
+        n = len(citizen_ids)
+        relatives = order[found]
+        pairs = np.sort(citizens * n + relatives)
+        reverse = relatives * n + citizens
+        found = np.searchsorted(pairs, reverse)
+        found[found == len(pairs)] = 0
+        invalid = pairs[found] != reverse
+        if invalid.any():
+            cid = citizen_ids[citizens[invalid].min()]
+            raise DataValidationError(f'Invalid relatives for `{cid}`')
+
+
+def validate_citizens(citizens: list):
+    validator = CitizensValidator()
+    validator.validate_many(citizens)
+    validator.finish()
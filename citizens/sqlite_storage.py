@@ -0,0 +1,328 @@
+import asyncio
+import datetime
+import functools
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict
+
+from citizens import reports
+from citizens.storage import (
+    BaseCitizensStorage, ImportNotFound, CitizenNotFound, RelativeNotFound
+)
+
+
+SCALAR_FIELDS = ('citizen_id', 'town', 'street', 'building', 'apartment',
+                 'name', 'birth_date', 'gender')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS imports (
+    import_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS citizens (
+    import_id INTEGER NOT NULL,
+    citizen_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    town TEXT NOT NULL,
+    street TEXT NOT NULL,
+    building TEXT NOT NULL,
+    apartment INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    birth_date TEXT NOT NULL,
+    gender TEXT NOT NULL,
+    birth_month INTEGER NOT NULL,
+    birth_year INTEGER NOT NULL,
+    PRIMARY KEY (import_id, citizen_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS citizens_by_position ON citizens (import_id, position);
+CREATE TABLE IF NOT EXISTS relatives (
+    import_id INTEGER NOT NULL,
+    citizen_id INTEGER NOT NULL,
+    relative_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (import_id, citizen_id, relative_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS presents (
+    import_id INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    citizen_id INTEGER NOT NULL,
+    presents INTEGER NOT NULL,
+    PRIMARY KEY (import_id, month, citizen_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS birth_years (
+    import_id INTEGER NOT NULL,
+    town TEXT NOT NULL,
+    birth_year INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (import_id, town, birth_year)
+) WITHOUT ROWID;
+'''
+
+# NOTE: список id передаем одним параметром, чтобы не упираться в лимит
+# на количество параметров в запросе
+IN_LIST = 'IN (SELECT value FROM json_each(?))'
+
+
+class SQLiteStorage(BaseCitizensStorage):
+    """
+    Хранилище на SQLite в режиме WAL. Не требует отдельного демона; файл
+    базы могут одновременно читать несколько процессов (воркеров supervisor-а),
+    запись сериализуется блокировкой SQLite.
+
+    Соединение однопоточное, поэтому все запросы выполняются в отдельном
+    потоке, чтобы не блокировать loop.
+    """
+    def __init__(self, config: dict):
+        self._connection = sqlite3.connect(
+            config.get('path', 'citizens.sqlite3'),
+            timeout=config.get('busy_timeout', 30),
+            isolation_level=None,  # транзакциями управляем сами
+            check_same_thread=False
+        )
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+        # NOTE: в базах, созданных до появления версий, колонки нет
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(imports)')]
+        if 'version' not in columns:
+            self._connection.execute(
+                'ALTER TABLE imports ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+        loop = asyncio.get_event_loop()
+        executor = ThreadPoolExecutor(max_workers=1)
+        self._async_run = functools.partial(loop.run_in_executor, executor)
+
+    async def _async(self, callable, *args, **kwargs):
+        func = functools.partial(callable, *args, **kwargs)
+        return await self._async_run(func)
+
+    def _transaction(self, callable, *args):
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = callable(connection, *args)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    def _check_import(self, import_id):
+        found = self._connection.execute(
+            'SELECT 1 FROM imports WHERE import_id = ?', (import_id,)
+        ).fetchone()
+        if not found:
+            raise ImportNotFound(f'Import `{import_id}` does not exists.')
+
+    async def import_citizens(self, citizens: List[Dict]):
+        return await self._async(self._transaction, self._import_citizens, citizens)
+
+    def _import_citizens(self, connection, citizens):
+        import_id = connection.execute('INSERT INTO imports DEFAULT VALUES').lastrowid
+        connection.executemany(
+            'INSERT INTO citizens VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                (import_id, c['citizen_id'], position, c['town'], c['street'],
+                 c['building'], c['apartment'], c['name'], c['birth_date'], c['gender'],
+                 *reports.birth_month_year(c['birth_date']))
+                for position, c in enumerate(citizens)
+            )
+        )
+        connection.executemany(
+            'INSERT INTO relatives VALUES (?, ?, ?, ?)',
+            (
+                (import_id, c['citizen_id'], rid, position)
+                for c in citizens for position, rid in enumerate(c['relatives'])
+            )
+        )
+        self._insert_reports(connection, import_id,
+                             reports.count_presents(citizens), reports.count_birth_years(citizens))
+        return import_id
+
+    def _insert_reports(self, connection, import_id, presents, birth_years):
+        connection.executemany(
+            'INSERT INTO presents VALUES (?, ?, ?, ?)',
+            ((import_id, month, citizen_id, count) for (month, citizen_id), count in presents.items())
+        )
+        connection.executemany(
+            'INSERT INTO birth_years VALUES (?, ?, ?, ?)',
+            ((import_id, town, year, count) for (town, year), count in birth_years.items())
+        )
+
+    def _update_presents(self, connection, import_id, citizen_id, old_data, values):
+        changed = reports.changed_relatives(citizen_id, old_data['relatives'],
+                                            values.get('relatives', old_data['relatives']))
+        relatives_months = dict(connection.execute(
+            f'SELECT citizen_id, birth_month FROM citizens WHERE import_id = ? AND citizen_id {IN_LIST}',
+            (import_id, json.dumps(list(changed)))
+        ))
+        changes = reports.presents_changes(citizen_id, old_data, values, relatives_months)
+        self._apply_changes(connection, import_id, 'presents', ('month', 'citizen_id'),
+                            'presents', changes)
+
+    def _apply_changes(self, connection, import_id, table, key_columns, count_column, changes):
+        """Прибавляет к счетчикам отчета изменения {ключ: дельта}, нулевые строки удаляет."""
+        first, second = key_columns
+        connection.executemany(
+            f'INSERT INTO {table} VALUES (?, ?, ?, ?) ON CONFLICT (import_id, {first}, {second}) '
+            f'DO UPDATE SET {count_column} = {count_column} + excluded.{count_column}',
+            ((import_id, *key, delta) for key, delta in changes.items())
+        )
+        connection.executemany(
+            f'DELETE FROM {table} WHERE import_id = ? AND {first} = ? AND {second} = ? '
+            f'AND {count_column} = 0',
+            ((import_id, *key) for key in changes)
+        )
+
+    def _select_citizens(self, import_id, where='', params=(), return_fields=None):
+        fields = SCALAR_FIELDS
+        if return_fields is not None:
+            fields = [name for name in SCALAR_FIELDS if name in return_fields]
+            if 'citizen_id' not in fields:
+                fields.insert(0, 'citizen_id')
+        query = 'SELECT {0} FROM citizens WHERE import_id = ? {1} ORDER BY position'.format(
+            ', '.join(fields), where)
+        rows = self._connection.execute(query, (import_id, *params)).fetchall()
+        citizens = [dict(zip(fields, row)) for row in rows]
+        if return_fields is None or 'relatives' in return_fields:
+            relatives = {c['citizen_id']: [] for c in citizens}
+            query = 'SELECT citizen_id, relative_id FROM relatives WHERE import_id = ?'
+            params = (import_id,)
+            if where:
+                query += f' AND citizen_id {IN_LIST}'
+                params += (json.dumps(list(relatives)),)
+            rows = self._connection.execute(query + ' ORDER BY citizen_id, position', params)
+            for citizen_id, relative_id in rows:
+                relatives[citizen_id].append(relative_id)
+            for citizen in citizens:
+                citizen['relatives'] = relatives[citizen['citizen_id']]
+        if return_fields is not None and 'citizen_id' not in return_fields:
+            for citizen in citizens:
+                del citizen['citizen_id']
+        return citizens
+
+    def _get_citizens(self, import_id, filter, return_fields):
+        self._check_import(import_id)
+        where = []
+        params = []
+        for name, value in (filter or {}).items():
+            if name not in SCALAR_FIELDS:
+                raise ValueError(f'Filter by `{name}` is not supported.')
+            if isinstance(value, list):
+                where.append(f'AND {name} {IN_LIST}')
+                params.append(json.dumps(value))
+            else:
+                where.append(f'AND {name} = ?')
+                params.append(value)
+        return self._select_citizens(import_id, ' '.join(where), params, return_fields)
+
+    async def get_citizens(self, import_id: int, filter: dict=None,
+                           return_fields: List[str]=None):
+        return await self._async(self._get_citizens, import_id, filter, return_fields)
+
+    async def iter_citizens(self, import_id: int, batch_size: int = 1000):
+        await self._async(self._check_import, import_id)
+        position = 0
+        while True:
+            batch = await self._async(
+                self._select_citizens, import_id, 'AND position >= ? AND position < ?',
+                (position, position + batch_size)
+            )
+            if not batch:
+                break
+            yield batch
+            position += batch_size
+
+    async def update_citizen(self, import_id: int, citizen_id: int, values: dict):
+        return await self._async(
+            self._transaction, self._update_citizen, import_id, citizen_id, values)
+
+    def _update_citizen(self, connection, import_id, citizen_id, values):
+        self._check_import(import_id)
+        found = self._select_citizens(import_id, 'AND citizen_id = ?', (citizen_id,))
+        if not found:
+            raise CitizenNotFound(f'Citizen `{citizen_id}` not found.')
+        old_data = found[0]
+        scalar_values = {k: v for k, v in values.items() if k in SCALAR_FIELDS}
+        if 'birth_date' in scalar_values:
+            month, year = reports.birth_month_year(scalar_values['birth_date'])
+            scalar_values.update(birth_month=month, birth_year=year)
+        if scalar_values:
+            assignments = ', '.join(f'{name} = ?' for name in scalar_values)
+            connection.execute(
+                f'UPDATE citizens SET {assignments} WHERE import_id = ? AND citizen_id = ?',
+                (*scalar_values.values(), import_id, citizen_id)
+            )
+        new_relatives = values.get('relatives')
+        if new_relatives is not None:
+            self._update_relatives(connection, import_id, citizen_id,
+                                   old_data['relatives'], new_relatives)
+        # NOTE: отчеты обновляем только на изменения
+        self._update_presents(connection, import_id, citizen_id, old_data, values)
+        self._apply_changes(connection, import_id, 'birth_years', ('town', 'birth_year'), 'count',
+                            reports.birth_years_changes(old_data, values))
+        connection.execute('UPDATE imports SET version = version + 1 WHERE import_id = ?',
+                           (import_id,))
+        old_data.update(values)
+        return old_data
+
+    def _update_relatives(self, connection, import_id, citizen_id, old_relatives, new_relatives):
+        cnt, = connection.execute(
+            f'SELECT COUNT(*) FROM citizens WHERE import_id = ? AND citizen_id {IN_LIST}',
+            (import_id, json.dumps(new_relatives))
+        ).fetchone()
+        if cnt != len(new_relatives):
+            raise RelativeNotFound('Relatives not found.')
+        connection.execute(
+            'DELETE FROM relatives WHERE import_id = ? AND citizen_id = ?',
+            (import_id, citizen_id)
+        )
+        connection.executemany(
+            'INSERT INTO relatives VALUES (?, ?, ?, ?)',
+            ((import_id, citizen_id, rid, position) for position, rid in enumerate(new_relatives))
+        )
+        # NOTE: на той стороне удаляем/добавляем меня в relatives
+        removed = [rid for rid in old_relatives if rid != citizen_id and rid not in new_relatives]
+        connection.executemany(
+            'DELETE FROM relatives WHERE import_id = ? AND citizen_id = ? AND relative_id = ?',
+            ((import_id, rid, citizen_id) for rid in removed)
+        )
+        added = [rid for rid in new_relatives if rid != citizen_id and rid not in old_relatives]
+        connection.executemany(
+            'INSERT OR IGNORE INTO relatives SELECT ?, ?, ?, COALESCE(MAX(position) + 1, 0) '
+            'FROM relatives WHERE import_id = ? AND citizen_id = ?',
+            ((import_id, rid, citizen_id, import_id, rid) for rid in added)
+        )
+
+    def _get_import_version(self, import_id):
+        found = self._connection.execute(
+            'SELECT version FROM imports WHERE import_id = ?', (import_id,)
+        ).fetchone()
+        if not found:
+            raise ImportNotFound(f'Import `{import_id}` does not exists.')
+        return found[0]
+
+    async def get_import_version(self, import_id: int):
+        return await self._async(self._get_import_version, import_id)
+
+    def _get_presents_by_month(self, import_id):
+        self._check_import(import_id)
+        rows = self._connection.execute(
+            'SELECT month, citizen_id, presents FROM presents WHERE import_id = ?', (import_id,))
+        return reports.presents_report({(month, cid): count for month, cid, count in rows})
+
+    async def get_presents_by_month(self, import_id: int):
+        return await self._async(self._get_presents_by_month, import_id)
+
+    def _get_ages_by_town(self, import_id):
+        self._check_import(import_id)
+        current_year = datetime.datetime.utcnow().date().year
+        rows = self._connection.execute(
+            'SELECT town, birth_year, count FROM birth_years WHERE import_id = ?', (import_id,))
+        return reports.ages_report({(town, year): count for town, year, count in rows}, current_year)
+
+    async def get_ages_by_town(self, import_id: int):
+        return await self._async(self._get_ages_by_town, import_id)
+
+    async def close(self):
+        await self._async(self._connection.close)
@@ -0,0 +1,71 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# NOTE: включается на запрос заголовком `X-Server-Timing: 1`
+SERVER_TIMING_HEADER = 'X-Server-Timing'
+
+_current = contextvars.ContextVar('server_timing', default=None)
+
+
+class ServerTiming:
+    """
+    Время этапов обработки запроса. Этапы могут быть вложенными, время
+    вложенного этапа не входит во время внешнего.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self._stack = []  # время вложенных этапов для каждого открытого этапа
+
+    def enter(self):
+        self._stack.append(0.0)
+        return time.perf_counter()
+
+    def exit(self, name, started):
+        elapsed = time.perf_counter() - started
+        nested = self._stack.pop()
+        if self._stack:
+            self._stack[-1] += elapsed
+        self.durations[name] = self.durations.get(name, 0.0) + elapsed - nested
+
+    def header(self):
+        stages = [f'{name};dur={duration * 1000:.2f}' for name, duration in self.durations.items()]
+        stages.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.2f}')
+        return ', '.join(stages)
+
+
+@contextmanager
+def stage(name):
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    started = timing.enter()
+    try:
+        yield
+    finally:
+        timing.exit(name, started)
+
+
+@web.middleware
+async def server_timing_middleware(request, handler):
+    if request.headers.get(SERVER_TIMING_HEADER) != '1':
+        return await handler(request)
+    timing = ServerTiming()
+    token = _current.set(timing)
+    request['server_timing'] = timing
+    try:
+        return await handler(request)
+    finally:
+        _current.reset(token)
+
+
+async def set_server_timing_header(request, response):
+    # NOTE: у потокового ответа заголовки уходят до тела, поэтому в них
+    # только этапы до отправки заголовков
+    timing = request.get('server_timing')
+    if timing is not None:
+        response.headers['Server-Timing'] = timing.header()
@@ -24,5 +24,9 @@ setup(
     ],
     license='MIT',
     platforms=['Ubuntu >= 18.04'],
-    install_requires=['aiohttp', 'aiojobs', 'pymongo', 'numpy']
+    install_requires=['aiohttp', 'aiojobs', 'pymongo', 'numpy', 'orjson'],
+    extras_require={
+        # MotorMongoStorage
+        'motor': ['motor'],
+    }
 )
@@ -0,0 +1,42 @@
+import argparse
+import pathlib
+import sys
+import time
+
+project_dir = str(pathlib.Path(__file__).parent.parent.parent.resolve())
+sys.path.insert(0, project_dir)
+
+from citizens.codec import CODEC_CLASSES
+
+from data import ImportDataGenerator
+
+
+def measure(func, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - t1
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(sizes, repeat):
+    for size in sizes:
+        data = {'data': ImportDataGenerator().generate_import_data(size)['citizens']}
+        print(f'{size} citizens:')
+        for name, codec_class in CODEC_CLASSES.items():
+            codec = codec_class()
+            body = codec.dumps(data)
+            encode = measure(codec.dumps, data, repeat)
+            decode = measure(codec.loads, body, repeat)
+            print('  {0:<8} encode {1:>8.2f} ms  decode {2:>8.2f} ms  {3:>10} bytes'.format(
+                name, encode * 1000, decode * 1000, len(body)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='JSON codecs benchmark')
+    parser.add_argument('--sizes', default='10000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    main([int(size) for size in args.sizes.split(',')], args.repeat)
@@ -0,0 +1,62 @@
+import argparse
+import asyncio
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+project_dir = str(pathlib.Path(__file__).parent.parent.parent.resolve())
+sys.path.insert(0, project_dir)
+
+from citizens.sqlite_storage import SQLiteStorage
+from citizens.storage import AsyncMongoStorage
+
+from data import ImportDataGenerator
+
+
+async def measure(name, coro):
+    t1 = time.time()
+    result = await coro
+    print('  {0:<24} {1:>10.3f} sec'.format(name, time.time() - t1))
+    return result
+
+
+async def benchmark(storage, citizens):
+    import_id = await measure('import_citizens', storage.import_citizens(citizens))
+    await measure('get_citizens', storage.get_citizens(import_id))
+    await measure('get_presents_by_month', storage.get_presents_by_month(import_id))
+    await measure('get_ages_by_town', storage.get_ages_by_town(import_id))
+    citizen = citizens[len(citizens) // 2]
+    values = {'name': 'Benchmark', 'relatives': citizen['relatives'][:1]}
+    await measure('update_citizen', storage.update_citizen(import_id, citizen['citizen_id'], values))
+
+
+async def main(sizes, mongo_connection_string):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storages = [
+            ('SQLiteStorage', lambda: SQLiteStorage({'path': os.path.join(tmpdir, 'citizens.sqlite3')})),
+            ('AsyncMongoStorage', lambda: AsyncMongoStorage({
+                'connection_string': mongo_connection_string, 'db': 'benchmark_citizens'})),
+        ]
+        for size in sizes:
+            citizens = ImportDataGenerator().generate_import_data(size)['citizens']
+            for name, create_storage in storages:
+                print(f'{name}, {size} citizens:')
+                storage = create_storage()
+                try:
+                    # NOTE: импорт может поменять данные (например, добавить `_id`), поэтому копия
+                    await benchmark(storage, [dict(c) for c in citizens])
+                except Exception as e:
+                    print(f'  failed: {e!r}')
+                finally:
+                    await storage.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Storages benchmark')
+    parser.add_argument('--sizes', default='10000,1000000')
+    parser.add_argument('--mongo', default='mongodb://localhost:27017/?serverSelectionTimeoutMS=2000')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    asyncio.run(main(sizes, args.mongo))
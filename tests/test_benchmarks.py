@@ -0,0 +1,14 @@
+import unittest
+
+from benchmarks.run import compare
+
+
+class TestCompare(unittest.TestCase):
+    def test_compare(self):
+        baseline = {'slow': 0.010, 'fast': 0.010, 'tiny': 0.0001, 'old': 0.010}
+        results = {'slow': 0.014, 'fast': 0.011, 'tiny': 0.0003, 'new': 0.010}
+        regressions = compare(results, baseline, threshold=0.3, min_time=0.0005)
+        self.assertEqual([name for name, *_ in regressions], ['slow'])
+        # NOTE: без порога по времени короткий замер тоже считается
+        regressions = compare(results, baseline, threshold=0.3)
+        self.assertEqual([name for name, *_ in regressions], ['slow', 'tiny'])
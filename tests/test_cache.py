@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+
+from citizens.cache import (
+    CitizensFileCache, CitizensSharedMemoryCache, ENCODINGS, _accepted_encodings, _preferred_encoding
+)
+
+
+class TestSharedMemoryCache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'citizens.cache')
+        self.cache = self.create_cache()
+
+    def tearDown(self):
+        self.cache.close()
+        self._tmpdir.cleanup()
+
+    def create_cache(self, **kwargs):
+        kwargs.setdefault('max_bytes', 1024)
+        kwargs.setdefault('max_entries', 8)
+        return CitizensSharedMemoryCache(self.path, **kwargs)
+
+    def test_put_get_clear(self):
+        self.assertIsNone(self.cache.get(1, 'get_citizens'))
+        self.cache.put(1, 'get_citizens', b'{"data": []}')
+        self.cache.put(1, 'get_citizens', b'{"data": [1]}')
+        self.cache.put(2, 'get_citizens', b'{"data": [2]}')
+        self.assertEqual(self.cache.get(1, 'get_citizens'), b'{"data": [1]}')
+        self.assertIsNone(self.cache.get(1, 'get_presents_by_month'))
+        self.cache.clear(1)
+        self.assertIsNone(self.cache.get(1, 'get_citizens'))
+        self.assertEqual(self.cache.get(2, 'get_citizens'), b'{"data": [2]}')
+
+    def test_shared_between_instances(self):
+        other = self.create_cache()
+        try:
+            self.cache.put(1, 'get_citizens', b'data')
+            self.assertEqual(other.get(1, 'get_citizens'), b'data')
+            other.clear(1)
+            self.assertIsNone(self.cache.get(1, 'get_citizens'))
+        finally:
+            other.close()
+
+    def test_budget(self):
+        for import_id in range(1, 5):
+            self.cache.put(import_id, 'get_citizens', bytes([import_id]) * 300)
+        # В 1024 байта помещаются только три последние записи
+        self.assertIsNone(self.cache.get(1, 'get_citizens'))
+        for import_id in range(2, 5):
+            self.assertEqual(self.cache.get(import_id, 'get_citizens'), bytes([import_id]) * 300)
+        self.cache.put(5, 'get_citizens', b'x' * 2000)
+        self.assertIsNone(self.cache.get(5, 'get_citizens'))
+        for import_id in range(10, 20):
+            self.cache.put(import_id, 'k', b'x')
+        # Записей не больше max_entries, вытесняются самые старые
+        self.assertIsNone(self.cache.get(10, 'k'))
+        self.assertEqual(self.cache.get(19, 'k'), b'x')
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.cache = CitizensFileCache(max_size=3, max_bytes=1000, cache_dir=self._tmpdir.name)
+
+    def tearDown(self):
+        self.cache.close()
+        self._tmpdir.cleanup()
+
+    def test_lru(self):
+        for import_id in range(1, 4):
+            self.cache.put(import_id, 'get_citizens', b'x')
+        # Читали первую запись, поэтому вытесняется вторая
+        self.assertEqual(self.cache.get(1, 'get_citizens'), b'x')
+        self.cache.put(4, 'get_citizens', b'x')
+        self.assertIsNone(self.cache.get(2, 'get_citizens'))
+        for import_id in (1, 3, 4):
+            self.assertEqual(self.cache.get(import_id, 'get_citizens'), b'x')
+        stats = self.cache.stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual((stats['hits'], stats['misses']), (4, 1))
+
+    def test_max_bytes(self):
+        self.cache.put(1, 'get_citizens', b'x' * 600)
+        self.cache.put(2, 'get_citizens', b'x' * 600)
+        self.assertIsNone(self.cache.get(1, 'get_citizens'))
+        self.assertEqual(self.cache.stats()['bytes'], 600)
+
+    def test_empty_dirs_removed(self):
+        for import_id in range(1, 100):
+            self.cache.put(import_id, 'get_citizens', b'x')
+        self.assertEqual(sorted(os.listdir(self._tmpdir.name)), ['97', '98', '99'])
+
+    def test_other_process_entries(self):
+        other = CitizensFileCache(max_size=3, max_bytes=1000, cache_dir=self._tmpdir.name, rescan_interval=0)
+        try:
+            for import_id in range(1, 4):
+                self.cache.put(import_id, 'get_citizens', b'x')
+            # NOTE: записи первого кеша другой процесс видит после перечитывания каталога
+            other.put(4, 'get_citizens', b'x')
+            self.assertEqual(other.stats()['entries'], 3)
+            self.assertIsNone(other.get(1, 'get_citizens'))
+        finally:
+            other.executor.shutdown()
+
+
+class TestAcceptEncoding(unittest.TestCase):
+    def test_accepted_encodings(self):
+        self.assertEqual(_accepted_encodings(''), [])
+        self.assertEqual(_accepted_encodings('identity'), [])
+        self.assertEqual(_accepted_encodings('gzip, deflate'), ['gzip'])
+        self.assertEqual(_accepted_encodings('gzip;q=0, deflate'), [])
+        self.assertEqual(_accepted_encodings('*'), list(ENCODINGS))
+        self.assertEqual(_accepted_encodings('*, br;q=0'), ['gzip'])
+        self.assertEqual(_preferred_encoding('gzip, deflate'), 'gzip')
+        self.assertIsNone(_preferred_encoding('identity'))
@@ -0,0 +1,21 @@
+import unittest
+
+from citizens.codec import CODEC_CLASSES, get_codec
+
+
+class TestCodecs(unittest.TestCase):
+    def test_round_trip(self):
+        data = {'data': [{'citizen_id': 1, 'name': 'Иванов', 'relatives': [2, 3]}]}
+        for name in CODEC_CLASSES:
+            codec = get_codec(name)
+            body = codec.dumps(data)
+            self.assertIsInstance(body, bytes)
+            self.assertEqual(codec.loads(body), data)
+            # NOTE: ответ про подарки по месяцам с числовыми ключами
+            self.assertEqual(codec.loads(codec.dumps({1: []})), {'1': []})
+            with self.assertRaises(ValueError):
+                codec.loads(b'{"data": ')
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            get_codec('bson')
@@ -1,7 +1,8 @@
 import unittest
 
 from citizens.schema import (
-    CitizenSchema, DataValidationError, validate_citizens
+    BatchValidationError, BirthDate, CitizenSchema, DataValidationError,
+    validate_citizens
 )
 
 
@@ -54,6 +55,7 @@ class TestData(unittest.TestCase):
             ('a', 'Field `citizen_id` is invalid: invalid type (`int` expected, got `str`)'),
             (b'1', 'Field `citizen_id` is invalid: invalid type (`int` expected, got `bytes`)'),
             (None, 'Field `citizen_id` is invalid: invalid type (`int` expected, got `NoneType`)'),
+            (2 ** 63, 'Field `citizen_id` is invalid: value must be <= 9223372036854775807'),
         ]
         for value, err in invalid_values:
             citizen_data = self.get_default_citizen_data({ 'citizen_id': value })
@@ -191,6 +193,30 @@ class TestData(unittest.TestCase):
             validate_citizens(citizens)
         self.assertEqual(str(e.exception), 'Invalid relatives for `1`')
 
+    def test_relatives_errors_order(self):
+        citizens = [
+            self.get_default_citizen_data({'citizen_id': 3, 'relatives': [5]}),
+            self.get_default_citizen_data({'citizen_id': 5, 'relatives': [5, 3]}),
+            self.get_default_citizen_data({'citizen_id': 4, 'relatives': [3]}),
+            self.get_default_citizen_data({'citizen_id': 3, 'relatives': [7, 8]}),
+            self.get_default_citizen_data({'citizen_id': 6, 'apartment': 0}),
+        ]
+        with self.assertRaises(DataValidationError) as e:
+            validate_citizens(citizens)
+        self.assertEqual(str(e.exception), 'Non unique citizen_id `3`')
+        citizens[3]['citizen_id'] = 7
+        with self.assertRaises(DataValidationError) as e:
+            validate_citizens(citizens)
+        self.assertEqual(str(e.exception), 'Field `apartment` is invalid: value must be > 0')
+        citizens[4]['apartment'] = 1
+        with self.assertRaises(DataValidationError) as e:
+            validate_citizens(citizens)
+        self.assertEqual(str(e.exception), 'There are 1 non existent relatives')
+        citizens[3]['relatives'] = []
+        with self.assertRaises(DataValidationError) as e:
+            validate_citizens(citizens)
+        self.assertEqual(str(e.exception), 'Invalid relatives for `4`')
+
     def test_null_values(self):
         for name in self.get_fields():
             citizen_data = self.get_default_citizen_data({name: None})
@@ -289,3 +315,56 @@ class TestData(unittest.TestCase):
         for value in date_valid_values:
             citizen_data['birth_date'] = value
             validate_citizens([citizen_data])
+
+    def test_compiled_schema_same_errors(self):
+        values = [None, 0, -1, 1, 1.0, '', ' ', '_', 'a', 'a' * 257, 'female', 'males',
+                  [], [1, 1], [0], ['1'], '31.02.1997', '1.1.2000', '01.01.5020', '1/1/2000']
+        for name, field in self.schema.fields.items():
+            for value in values:
+                try:
+                    field.validate(value)
+                    expected = None
+                except DataValidationError as e:
+                    expected = f'Field `{name}` is invalid: {e}'
+                try:
+                    self.schema.validate({name: value}, partial=True)
+                    got = None
+                except DataValidationError as e:
+                    got = str(e)
+                self.assertEqual(got, expected)
+
+    def test_birth_date_batch(self):
+        field = BirthDate()
+        values = ['1.1.1900', '17.04.1999', '29.02.2016', '1.1.0001', '31.12.2000',
+                  '31.02.1997', '29.02.2019', '29.02.1900', '00.00.0000', '1.13.2000',
+                  '001.02.1997', '11/02/1997', '21.02.20191', '..', '', 'a' * 100,
+                  '01.01.5020', '17.04.1999\n', '1.1.2000\x00', '\u0661.1.2000']
+        for value in values:
+            try:
+                field.validate(value)
+                expected = None
+            except DataValidationError as e:
+                expected = str(e)
+            try:
+                field.validate_batch(['1.1.2000', value])
+                got = None
+            except BatchValidationError as e:
+                self.assertEqual(e.index, 1)
+                got = str(e)
+            self.assertEqual(got, expected, value)
+
+    def test_birth_date_batch_errors_order(self):
+        citizens = [
+            self.get_default_citizen_data({'citizen_id': 1}),
+            self.get_default_citizen_data({'citizen_id': 2, 'birth_date': '31.02.1997'}),
+            self.get_default_citizen_data({'citizen_id': 1}),
+        ]
+        with self.assertRaises(DataValidationError) as ctx:
+            validate_citizens(citizens)
+        self.assertEqual(str(ctx.exception), 'Field `birth_date` is invalid: day is out of range for month')
+        citizens[1] = self.get_default_citizen_data({'citizen_id': 2, 'birth_date': '1.1.1',
+                                                     'gender': 'unknown'})
+        with self.assertRaises(DataValidationError) as ctx:
+            validate_citizens(citizens)
+        self.assertEqual(str(ctx.exception),
+                         'Field `birth_date` is invalid: invalid format. `dd.mm.yyyy` expected')
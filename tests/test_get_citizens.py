@@ -1,3 +1,4 @@
+import asyncio
 import json
 
 from aiohttp.test_utils import unittest_run_loop
@@ -56,3 +57,122 @@ class TestGetCitizens(CitizensApiTestCase):
         import_id = 100
         status, _ = await self.api_request('GET', f'/imports/{import_id}/citizens')
         self.assertEqual(status, 400)
+
+    @unittest_run_loop
+    async def test_etag(self):
+        citizen = {
+            "citizen_id": 1,
+            "town": "Москва",
+            "street": "Льва Толстого",
+            "building": "16к7стр5",
+            "apartment": 7,
+            "name": "Иванов Сергей Иванович",
+            "birth_date": "17.04.1997",
+            "gender": "male",
+            "relatives": []
+        }
+        import_id = await self.import_data([citizen])
+        uri = f'/imports/{import_id}/citizens'
+        response = await self.client.get(uri)
+        self.assertEqual(response.status, 200)
+        etag = response.headers['ETag']
+        response = await self.client.get(uri, headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(await response.read(), b'')
+        response = await self.client.get(f'/imports/{import_id}/citizens/birthdays',
+                                         headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        status, _ = await self.api_request('PATCH', f'{uri}/1', {'name': 'Иванов Иван'})
+        self.assertEqual(status, 200)
+        response = await self.client.get(uri, headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    @unittest_run_loop
+    async def test_cached_etag(self):
+        if not hasattr(self.app, 'cache'):
+            self.skipTest('cache is disabled')
+        citizen = {
+            "citizen_id": 1,
+            "town": "Москва",
+            "street": "Льва Толстого",
+            "building": "16к7стр5",
+            "apartment": 7,
+            "name": "Иванов Сергей Иванович",
+            "birth_date": "17.04.1997",
+            "gender": "male",
+            "relatives": []
+        }
+        import_id = await self.import_data([citizen])
+        uri = f'/imports/{import_id}/citizens'
+        response = await self.client.get(uri)
+        etag = response.headers['ETag']
+        # NOTE: потоковый ответ кладется в кеш уже после отправки, ждем
+        # ответа из кеша: он, в отличие от потокового, с Content-Length
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            response = await self.client.get(uri)
+            await response.read()
+            if 'Content-Length' in response.headers:
+                break
+        storage = self.app.storage
+
+        async def get_import_version(import_id):
+            raise AssertionError('storage must not be used')
+
+        # NOTE: ответ и его ETag уже в кеше, хранилище не нужно
+        storage.get_import_version = get_import_version
+        try:
+            response = await self.client.get(uri, headers={'If-None-Match': etag})
+            self.assertEqual(response.status, 304)
+            self.assertEqual(response.headers['ETag'], etag)
+            response = await self.client.get(uri)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.headers['ETag'], etag)
+        finally:
+            del storage.get_import_version
+        status, _ = await self.api_request('PATCH', f'{uri}/1', {'name': 'Иванов Иван'})
+        self.assertEqual(status, 200)
+        response = await self.client.get(uri, headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    @unittest_run_loop
+    async def test_compressed_response(self):
+        citizens = [
+            {
+                "citizen_id": citizen_id,
+                "town": "Москва",
+                "street": "Льва Толстого",
+                "building": "16к7стр5",
+                "apartment": citizen_id,
+                "name": "Иванов Сергей Иванович",
+                "birth_date": "17.04.1997",
+                "gender": "male",
+                "relatives": []
+            } for citizen_id in range(1, 50)
+        ]
+        import_id = await self.import_data(citizens)
+        uri = f'/imports/{import_id}/citizens'
+        headers = {'Accept-Encoding': 'gzip'}
+        response = await self.client.get(uri, headers=headers)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(json.loads(await response.read())['data'], citizens)
+        # NOTE: второй запрос отдается из кеша уже сжатым, за одно обращение к кешу
+        stats = self.app.cache.stats()
+        response = await self.client.get(uri, headers=headers)
+        self.assertEqual(self.app.cache.stats()['hits'], stats['hits'] + 1)
+        self.assertEqual(self.app.cache.stats()['misses'], stats['misses'])
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertTrue(response.headers['ETag'].endswith('-gzip"'))
+        self.assertEqual(json.loads(await response.read())['data'], citizens)
+        etag = response.headers['ETag']
+        response = await self.client.get(uri, headers={'If-None-Match': etag, **headers})
+        self.assertEqual(response.status, 304)
+        response = await self.client.get(uri, headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(json.loads(await response.read())['data'], citizens)
@@ -1,8 +1,9 @@
+import asyncio
 import json
 
 from aiohttp.test_utils import unittest_run_loop
 
-from tests.utils import CitizensApiTestCase
+from tests.utils import CitizensApiTestCase, make_citizen
 
 
 class TestGetPresentsByMonth(CitizensApiTestCase):
@@ -177,3 +178,42 @@ class TestGetPresentsByMonth(CitizensApiTestCase):
         import_id = 100
         status, _ = await self.api_request('GET', f'/imports/{import_id}/citizens/birthdays')
         self.assertEqual(status, 400)
+
+    @unittest_run_loop
+    async def test_update_during_cache_fill(self):
+        if not hasattr(self.app, 'cache'):
+            self.skipTest('cache is disabled')
+        citizens = [
+            make_citizen(1, birth_date='17.06.1997', relatives=[2]),
+            make_citizen(2, birth_date='17.04.1997', relatives=[1]),
+        ]
+        import_id = await self.import_data(citizens)
+        uri = f'/imports/{import_id}/citizens/birthdays'
+        storage = self.app.storage
+        report_ready = asyncio.Event()
+        update_done = asyncio.Event()
+
+        async def get_presents_by_month(import_id):
+            report = await type(storage).get_presents_by_month(storage, import_id)
+            report_ready.set()
+            # NOTE: отчет по старым данным, пока он в пути, данные меняются
+            await update_done.wait()
+            return report
+
+        storage.get_presents_by_month = get_presents_by_month
+        try:
+            request = asyncio.ensure_future(self.api_request('GET', uri))
+            await report_ready.wait()
+            status, _ = await self.api_request('PATCH', f'/imports/{import_id}/citizens/2', {'relatives': []})
+            self.assertEqual(status, 200)
+            update_done.set()
+            status, _ = await request
+            self.assertEqual(status, 200)
+        finally:
+            del storage.get_presents_by_month
+        response = await self.client.get(uri)
+        data = await response.json()
+        self.assertEqual(data['data']['4'], [])
+        self.assertEqual(data['data']['6'], [])
+        version = await storage.get_import_version(import_id)
+        self.assertEqual(response.headers['ETag'], f'"{import_id}-{version}-get_presents_by_month"')
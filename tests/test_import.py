@@ -199,3 +199,8 @@ class TestImport(CitizensApiTestCase):
         ]
         status, _ = await self.api_request('POST', '/imports', {'citizens': citizens})
         self.assertEqual(status, 400)
+
+    @unittest_run_loop
+    async def test_invalid_json(self):
+        response = await self.client.request('POST', '/imports', data='{"citizens": [{"citizen_id": 1,')
+        self.assertEqual(response.status, 400)
@@ -0,0 +1,64 @@
+import asyncio
+import json
+import unittest
+
+from citizens.jsonstream import (
+    BytesStream, JsonArrayReader, JsonBodyTooLarge, JsonStreamError
+)
+
+
+class TestJsonArrayReader(unittest.TestCase):
+    def read_items(self, data, chunk_size=7, **kwargs):
+        if isinstance(data, str):
+            data = data.encode()
+        reader = JsonArrayReader(BytesStream(data), 'citizens', chunk_size=chunk_size, **kwargs)
+
+        async def read():
+            return [item async for item in reader]
+        return asyncio.run(read()), reader.key_found
+
+    def test_items(self):
+        citizens = [
+            {'citizen_id': i, 'name': 'Иванов Сергей Иванович', 'relatives': [1, 22, 333]}
+            for i in range(1, 50)
+        ]
+        data = json.dumps({'before': {'x': [1, 2]}, 'citizens': citizens, 'after': 12345},
+                          ensure_ascii=False, indent=2)
+        for chunk_size in (1, 3, 64, 1024 ** 2):
+            items, key_found = self.read_items(data, chunk_size=chunk_size)
+            self.assertTrue(key_found)
+            self.assertEqual(items, citizens)
+
+    def test_empty(self):
+        self.assertEqual(self.read_items('{"citizens": []}'), ([], True))
+        self.assertEqual(self.read_items('{}'), ([], False))
+        self.assertEqual(self.read_items(' {"other": [1]} '), ([], False))
+
+    def test_invalid_json(self):
+        invalid_values = [
+            '',
+            '[]',
+            '{"citizens": [1, 2',
+            '{"citizens": [1 2]}',
+            '{"citizens": [1, 2],}',
+            '{"citizens": [{"a": }]}',
+            '{"citizens": []} []',
+            b'{"citizens": ["\xff"]}',
+        ]
+        for value in invalid_values:
+            with self.assertRaises(JsonStreamError):
+                self.read_items(value)
+
+    def test_fail_fast(self):
+        stream = BytesStream(b'{"citizens": [{"a": 1}, {"b": 2}' + b' ' * 10 ** 6 + b']}')
+        reader = JsonArrayReader(stream, 'citizens', chunk_size=16)
+
+        async def read_first():
+            async for item in reader:
+                return item
+        self.assertEqual(asyncio.run(read_first()), {'a': 1})
+        self.assertLess(stream._pos, 100)
+
+    def test_too_large(self):
+        with self.assertRaises(JsonBodyTooLarge):
+            self.read_items('{"citizens": [1, 2, 3]}', max_size=10)
@@ -0,0 +1,26 @@
+import unittest
+
+from citizens.memory_storage import MemoryStorage
+from tests.utils import StorageTestsMixin, make_citizen, run_loop
+
+
+class TestMemoryStorage(StorageTestsMixin, unittest.TestCase):
+    def create_storage(self):
+        return MemoryStorage({})
+
+    @run_loop
+    async def test_referenced_by(self):
+        import_id = await self.storage.import_citizens([
+            make_citizen(1, relatives=[1, 2]),
+            make_citizen(2, relatives=[1]),
+            make_citizen(3),
+        ])
+        await self.storage.update_citizen(import_id, 1, {'relatives': [3]})
+        await self.storage.update_citizen(import_id, 2, {'relatives': [2, 3]})
+        citizens_import = self.storage._imports[import_id]
+        expected = {}
+        for citizen in citizens_import.citizens:
+            for rid in citizen.relatives:
+                expected.setdefault(rid, set()).add(citizen.citizen_id)
+        self.assertEqual(citizens_import.referenced_by, expected)
+        self.assertEqual(expected, {2: {2, 3}, 3: {1, 2}, 1: {3}})
@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import unittest
+
+from aiohttp.test_utils import unittest_run_loop
+
+from citizens.metrics import Metrics
+from tests.utils import CitizensApiTestCase
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.metrics = Metrics(self._tmpdir.name, buckets=(0.1, 1.0))
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_aggregate_processes(self):
+        self.metrics.inc('requests_total', route='/a')
+        self.metrics.observe('duration_seconds', 0.05, route='/a')
+        self.metrics.observe('duration_seconds', 5, route='/a')
+        self.metrics.flush([('jobs_active', (), 1)])
+        # NOTE: файл другого живого процесса
+        with open(os.path.join(self._tmpdir.name, f'{os.getppid()}.json'), 'w') as f:
+            json.dump(self.metrics.snapshot(), f)
+        # и умершего, его счетчики переносятся в накопленные
+        with open(os.path.join(self._tmpdir.name, '999999999.json'), 'w') as f:
+            json.dump(self.metrics.snapshot([('jobs_active', (), 5)]), f)
+        lines = self.metrics.render().splitlines()
+        self.assertIn('requests_total{route="/a"} 3', lines)
+        self.assertIn('duration_seconds_bucket{route="/a",le="0.1"} 3', lines)
+        self.assertIn('duration_seconds_bucket{route="/a",le="1.0"} 3', lines)
+        self.assertIn('duration_seconds_bucket{route="/a",le="+Inf"} 6', lines)
+        self.assertIn('duration_seconds_count{route="/a"} 6', lines)
+        self.assertIn(f'jobs_active{{pid="{os.getpid()}"}} 1', lines)
+        self.assertNotIn('jobs_active{pid="999999999"} 5', lines)
+        self.assertFalse(os.path.exists(os.path.join(self._tmpdir.name, '999999999.json')))
+        # NOTE: файл умершего процесса учитывается один раз
+        self.assertIn('requests_total{route="/a"} 3', self.metrics.render().splitlines())
+
+    def test_counters_after_remove(self):
+        self.metrics.inc('requests_total', route='/a')
+        self.metrics.flush()
+        self.metrics.remove()
+        # NOTE: после перезапуска процесса счетчики не уменьшаются
+        metrics = Metrics(self._tmpdir.name, buckets=(0.1, 1.0))
+        metrics.inc('requests_total', route='/a')
+        metrics.flush()
+        self.assertIn('requests_total{route="/a"} 2', metrics.render().splitlines())
+
+class TestMetricsApi(CitizensApiTestCase):
+    async def get_application(self):
+        # NOTE: накопленные счетчики других запусков в общем каталоге мешают проверкам
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.config = {'metrics': {'metrics_dir': self._tmpdir.name}}
+        return await super().get_application()
+
+    def tearDown(self):
+        super().tearDown()
+        self._tmpdir.cleanup()
+
+    @unittest_run_loop
+    async def test_metrics(self):
+        status, _ = await self.api_request('GET', '/imports/100/citizens')
+        self.assertEqual(status, 400)
+        response = await self.client.get('/metrics')
+        self.assertEqual(response.status, 200)
+        text = await response.text()
+        self.assertIn('citizens_request_duration_seconds_count{method="GET",'
+                      'route="/imports/{import_id}/citizens",status="400"} 1', text)
+        self.assertIn('# TYPE citizens_jobs_active gauge', text)
+        if hasattr(self.app, 'cache'):
+            self.assertIn('# TYPE citizens_cache_evictions_total counter', text)
+
+    def test_storage_metrics(self):
+        self.assertIs(self.app.storage.metrics, self.app.metrics)
@@ -1,7 +1,13 @@
 import asyncio
+import json
 import unittest
 
-from citizens.storage import AsyncMongoStorage, ImportNotFound
+import bson
+import pymongo
+
+from citizens.codec import CODEC_CLASSES, get_codec
+from citizens.storage import AsyncMongoStorage, ImportNotFound, ImportsRegistry, raw_batch_to_json
+from tests.utils import make_citizen
 
 
 def run_loop(coro):
@@ -74,3 +80,183 @@ class TestMongoStorage(unittest.TestCase):
         with self.assertRaises(ImportNotFound) as ctx:
             _ = list(await self.storage.get_citizens(999))
         self.assertEqual(str(ctx.exception), 'Import `999` does not exists.')
+
+    @run_loop
+    async def test_concurrent_update_relatives(self):
+        citizens = [make_citizen(citizen_id) for citizen_id in range(1, 6)]
+        import_id = await self.storage.import_citizens(citizens)
+        await asyncio.gather(*(
+            self.storage.update_citizen(import_id, 1, {'relatives': [rid]}) for rid in range(2, 6)
+        ))
+        citizens = {c['citizen_id']: c for c in await self.storage.get_citizens(import_id)}
+        self.assertEqual(len(citizens[1]['relatives']), 1)
+        for citizen_id, citizen in citizens.items():
+            for rid in citizen['relatives']:
+                self.assertIn(citizen_id, citizens[rid]['relatives'])
+        presents = await self.storage.get_presents_by_month(import_id)
+        self.assertEqual(sum(c['presents'] for month in presents for c in month['citizens']), 2)
+
+    @run_loop
+    async def test_reports_of_legacy_import(self):
+        citizens = [
+            make_citizen(1, birth_date='17.06.1997', relatives=[2]),
+            make_citizen(2, birth_date='17.04.1997', relatives=[1]),
+        ]
+        import_id = await self.storage.import_citizens(citizens)
+        # NOTE: так выглядит выгрузка, загруженная до появления отчетов
+        db = self.storage._db
+        db.drop_collection(f'citizens_import_{import_id}_presents')
+        db.drop_collection(f'citizens_import_{import_id}_birth_years')
+        db.get_collection('imports').delete_one({'_id': import_id})
+        storage = AsyncMongoStorage({'connection_string': 'mongodb://localhost:27017', 'db': 'test_citizens'})
+        try:
+            presents = await storage.get_presents_by_month(import_id)
+            self.assertEqual(presents, [
+                {'month': 4, 'citizens': [{'citizen_id': 1, 'presents': 1}]},
+                {'month': 6, 'citizens': [{'citizen_id': 2, 'presents': 1}]},
+            ])
+            await storage.update_citizen(import_id, 2, {'relatives': []})
+            self.assertEqual(await storage.get_presents_by_month(import_id), [])
+            self.assertEqual(await storage.get_ages_by_town(import_id),
+                             await self.storage.get_ages_by_town(import_id))
+        finally:
+            await storage.close()
+
+    @run_loop
+    async def test_import_ids_blocks(self):
+        other = AsyncMongoStorage({
+            'connection_string': 'mongodb://localhost:27017',
+            'db': 'test_citizens',
+            'import_ids_block_size': 3,
+        })
+        try:
+            ids = []
+            for _ in range(4):
+                ids.append(await self.storage._generate_import_id())
+                ids.append(await other._generate_import_id())
+        finally:
+            await other.close()
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertTrue(all(import_id > 0 for import_id in ids))
+
+
+class TestImportIndex(unittest.TestCase):
+    def test_background_index(self):
+        # NOTE: MongoClient подключается лениво, сервер для этого теста не нужен
+        storage = AsyncMongoStorage({'connection_string': 'mongodb://localhost:27017', 'db': 'test_citizens'})
+        calls = []
+
+        async def record(callable, *args, **kwargs):
+            calls.append((getattr(callable, '__name__', None), args, kwargs))
+
+        async def generate_import_id():
+            return 1
+
+        async def save_reports(import_id, citizens):
+            pass
+
+        storage._async = record
+        storage._generate_import_id = generate_import_id
+        storage._save_reports = save_reports
+        try:
+            asyncio.run(storage.import_citizens([make_citizen(1)]))
+        finally:
+            storage._driver.close()
+        create_index = [(args, kwargs) for name, args, kwargs in calls if name == 'create_index']
+        self.assertEqual(create_index, [(([('citizen_id', 1)],), {'background': True})])
+
+
+class TestImportFailure(unittest.TestCase):
+    def test_failed_import_dropped(self):
+        calls = []
+
+        async def record(callable, *args, **kwargs):
+            name = getattr(callable, '__name__', None)
+            calls.append((name, getattr(callable, '__self__', None)))
+            if name == 'insert_many':
+                raise pymongo.errors.BulkWriteError({'writeErrors': []})
+
+        async def generate_import_id():
+            return 1
+
+        async def import_citizens():
+            # NOTE: MongoClient подключается лениво, сервер для этого теста не нужен
+            storage = AsyncMongoStorage({'connection_string': 'mongodb://localhost:27017', 'db': 'test_citizens',
+                                         'insert_chunk_size': 1})
+            storage._async = record
+            storage._generate_import_id = generate_import_id
+            try:
+                with self.assertRaises(pymongo.errors.BulkWriteError):
+                    await storage.import_citizens([make_citizen(1), make_citizen(2)])
+                self.assertFalse(storage._registry.is_known(1))
+            finally:
+                storage._driver.close()
+
+        asyncio.run(import_citizens())
+        names = [name for name, _ in calls]
+        # NOTE: выгрузка удаляется только после того, как закончились все вставки
+        self.assertEqual(names[-4:], ['drop', 'drop', 'drop', 'delete_one'])
+        self.assertNotIn('insert_many', names[names.index('drop'):])
+        dropped = {obj.name for name, obj in calls if name == 'drop'}
+        self.assertEqual(dropped, {'citizens_import_1', 'citizens_import_1_presents',
+                                   'citizens_import_1_birth_years'})
+
+
+class TestImportVersion(unittest.TestCase):
+    def test_unknown_import(self):
+        calls = []
+
+        async def record(callable, *args, **kwargs):
+            calls.append(getattr(callable, '__name__', None))
+
+        async def get_import_version():
+            # NOTE: MongoClient подключается лениво, сервер для этого теста не нужен
+            storage = AsyncMongoStorage({'connection_string': 'mongodb://localhost:27017', 'db': 'test_citizens'})
+            storage._async = storage._fetch = record
+            storage._registry_loaded = asyncio.ensure_future(asyncio.sleep(0))
+            storage._registry.add_missing(999)
+            try:
+                with self.assertRaises(ImportNotFound):
+                    await storage.get_import_version(999)
+            finally:
+                storage._driver.close()
+
+        asyncio.run(get_import_version())
+        self.assertEqual(calls, [])
+
+
+class TestRawBatchToJson(unittest.TestCase):
+    def test_raw_batch_to_json(self):
+        citizens = [
+            {'citizen_id': 1, 'name': 'Иванов "Иван"', 'relatives': [2 ** 62]},
+            {'citizen_id': 2 ** 62, 'name': 'Bob', 'relatives': [1]},
+        ]
+        data = b''.join(bson.encode(citizen) for citizen in citizens)
+        for name in CODEC_CLASSES:
+            body = raw_batch_to_json(data, get_codec(name))
+            self.assertEqual(json.loads(b'[' + body + b']'), citizens)
+            # NOTE: порядок полей сохраняется
+            self.assertEqual(list(json.loads(b'[' + body + b']')[0]), ['citizen_id', 'name', 'relatives'])
+        self.assertEqual(raw_batch_to_json(b'', get_codec()), b'')
+
+
+class TestImportsRegistry(unittest.TestCase):
+    def test_negative_cache(self):
+        registry = ImportsRegistry(negative_cache_size=2, negative_cache_ttl=60)
+        registry.add(3)
+        self.assertTrue(registry.is_known(3))
+        self.assertEqual(registry.max_known, 3)
+        for import_id in (1, 2, 4):
+            registry.add_missing(import_id)
+        # NOTE: размер ограничен, самый старый вытеснен
+        self.assertFalse(registry.is_missing(1))
+        self.assertTrue(registry.is_missing(2))
+        self.assertTrue(registry.is_missing(4))
+        registry.add(4)
+        self.assertFalse(registry.is_missing(4))
+        self.assertEqual(registry.max_known, 4)
+
+    def test_negative_cache_ttl(self):
+        registry = ImportsRegistry(negative_cache_ttl=0)
+        registry.add_missing(1)
+        self.assertFalse(registry.is_missing(1))
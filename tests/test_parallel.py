@@ -0,0 +1,94 @@
+import asyncio
+import json
+import unittest
+
+from aiohttp.test_utils import unittest_run_loop
+
+from citizens.parallel import ParallelImportValidator, SharedBody, split_citizens
+from citizens.schema import DataValidationError, validate_citizens
+from tests.utils import CitizensApiTestCase, make_citizen
+
+
+class TestParallelImport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = ParallelImportValidator({'processes': 2})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def validate(self, data):
+        body = SharedBody(len(data))
+        body.view[:] = data
+        try:
+            return asyncio.run(self.pool.validate(body))
+        finally:
+            body.close()
+
+    def test_split(self):
+        citizens = [make_citizen(i, name='}, {') for i in range(1, 20)]
+        body = json.dumps({'citizens': citizens}, ensure_ascii=False, indent=1).encode()
+        ranges = split_citizens(body, 5)
+        self.assertGreater(len(ranges), 1)
+        chunks = [json.loads(b'[' + body[start:end] + b']') for start, end in ranges]
+        self.assertEqual(sum(chunks, []), citizens)
+        self.assertIsNone(split_citizens(b'{"other": []}', 5))
+        self.assertEqual(split_citizens(b'{"citizens": []}', 5), [(14, 14)])
+
+    def test_valid(self):
+        citizens = [make_citizen(i, relatives=[i + 1 if i % 2 else i - 1]) for i in range(1, 101)]
+        body = json.dumps({'citizens': citizens}).encode()
+        self.assertEqual(self.validate(body), citizens)
+
+    def test_same_errors(self):
+        cases = [
+            {50: {'citizen_id': 3}},
+            {50: {'citizen_id': 3}, 70: {'apartment': 0}},
+            {70: {'citizen_id': 3}, 50: {'birth_date': '31.02.2000'}},
+            {90: {'relatives': [1000]}},
+            {90: {'relatives': [1]}},
+        ]
+        for changes in cases:
+            citizens = [make_citizen(i) for i in range(1, 101)]
+            for index, values in changes.items():
+                citizens[index].update(values)
+            with self.assertRaises(DataValidationError) as ctx:
+                validate_citizens(citizens)
+            body = json.dumps({'citizens': citizens}).encode()
+            with self.assertRaises(DataValidationError) as parallel_ctx:
+                self.validate(body)
+            self.assertEqual(str(parallel_ctx.exception), str(ctx.exception))
+
+    def test_fallback(self):
+        # Граница попадает внутрь строки, такой кусок не разбирается
+        citizens = [make_citizen(i, name='a' * 50 + '}, {' + 'a' * 50) for i in range(1, 4)]
+        body = json.dumps({'citizens': citizens}).encode()
+        self.assertIsNone(self.validate(body))
+        self.assertIsNone(self.validate(b'{"citizens": [1], "x": [2]}'))
+
+
+class TestParallelImportApi(CitizensApiTestCase):
+    async def get_application(self):
+        app = await super().get_application()
+        app.import_validator = ParallelImportValidator({'processes': 1, 'min_size': 0})
+        return app
+
+    def tearDown(self):
+        super().tearDown()
+        self.app.import_validator.close()
+
+    @unittest_run_loop
+    async def test_import(self):
+        citizens = [make_citizen(i, relatives=[i + 1 if i % 2 else i - 1]) for i in range(1, 11)]
+        import_id = await self.import_data(citizens)
+        status, data = await self.api_request('GET', f'/imports/{import_id}/citizens')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['data'], citizens)
+        citizens[5]['apartment'] = 0
+        status, _ = await self.api_request('POST', '/imports', {'citizens': citizens})
+        self.assertEqual(status, 400)
+        # Не разбивается на куски, проверяется как обычно
+        citizens = [make_citizen(i, name='}, {') for i in range(1, 4)]
+        status, _ = await self.api_request('POST', '/imports', {'citizens': citizens})
+        self.assertEqual(status, 201)
@@ -0,0 +1,71 @@
+import unittest
+
+import numpy as np
+
+from citizens import reports
+from tests.utils import make_citizen
+
+
+class TestReports(unittest.TestCase):
+    def setUp(self):
+        self.citizens = [
+            make_citizen(1, '17.06.1997', 'Москва', [1, 2, 3]),
+            make_citizen(2, '07.03.1987', 'Москва', [1]),
+            make_citizen(3, '07.03.1988', 'Амстердам', [1]),
+        ]
+
+    def test_presents(self):
+        presents = reports.count_presents(self.citizens)
+        self.assertEqual(reports.presents_report(presents), [
+            {'month': 3, 'citizens': [{'citizen_id': 1, 'presents': 2}]},
+            {'month': 6, 'citizens': [
+                {'citizen_id': 1, 'presents': 1},
+                {'citizen_id': 2, 'presents': 1},
+                {'citizen_id': 3, 'presents': 1},
+            ]},
+        ])
+
+    def test_ages(self):
+        birth_years = reports.count_birth_years(self.citizens)
+        self.assertEqual(reports.ages_report(birth_years, 2020), [
+            {'town': 'Амстердам', 'ages': {32: 1}},
+            {'town': 'Москва', 'ages': {23: 1, 33: 1}},
+        ])
+        birth_years.update(reports.birth_years_changes(self.citizens[2], {'town': 'Москва'}))
+        self.assertEqual(reports.ages_report(birth_years, 2020), [
+            {'town': 'Москва', 'ages': {23: 1, 32: 1, 33: 1}},
+        ])
+
+    def test_percentile(self):
+        histogram = {10: 3, 20: 1, 35: 2, 90: 1}
+        ages = [10, 10, 10, 20, 35, 35, 90]
+        for q in (0, 50, 75, 99, 100):
+            self.assertEqual(reports.percentile(histogram, q), np.percentile(ages, q))
+
+    def test_presents_changes(self):
+        updates = [
+            (1, {'relatives': [2]}),
+            (2, {'birth_date': '01.01.2000'}),
+            (3, {'relatives': [3, 2], 'birth_date': '01.12.2000'}),
+            (1, {'relatives': [1, 2, 3], 'birth_date': '01.02.2000'}),
+        ]
+        citizens = {citizen['citizen_id']: citizen for citizen in self.citizens}
+        presents = reports.count_presents(self.citizens)
+        for citizen_id, values in updates:
+            old_data = dict(citizens[citizen_id])
+            new_relatives = values.get('relatives', old_data['relatives'])
+            changed = reports.changed_relatives(citizen_id, old_data['relatives'], new_relatives)
+            relatives_months = {
+                rid: reports.birth_month_year(citizens[rid]['birth_date'])[0] for rid in changed
+            }
+            presents.update(reports.presents_changes(citizen_id, old_data, values, relatives_months))
+            # Обновляем жителей так же, как хранилище
+            citizens[citizen_id].update(values)
+            for rid in changed:
+                relatives = citizens[rid]['relatives']
+                if rid in new_relatives:
+                    relatives.append(citizen_id)
+                else:
+                    relatives.remove(citizen_id)
+            self.assertEqual(reports.presents_report(presents),
+                             reports.presents_report(reports.count_presents(self.citizens)))
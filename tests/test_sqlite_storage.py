@@ -0,0 +1,22 @@
+import os
+import tempfile
+import unittest
+
+from citizens.sqlite_storage import SQLiteStorage
+from tests.utils import StorageTestsMixin, make_citizen, run_loop
+
+
+class TestSQLiteStorage(StorageTestsMixin, unittest.TestCase):
+    def create_storage(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        return SQLiteStorage({'path': os.path.join(self._tmpdir.name, 'citizens.sqlite3')})
+
+    @run_loop
+    async def test_shared_file(self):
+        import_id = await self.storage.import_citizens([make_citizen(1)])
+        other = SQLiteStorage({'path': os.path.join(self._tmpdir.name, 'citizens.sqlite3')})
+        try:
+            self.assertEqual(await other.get_citizens(import_id), [make_citizen(1)])
+        finally:
+            await other.close()
@@ -0,0 +1,61 @@
+import time
+import unittest
+
+from aiohttp.test_utils import unittest_run_loop
+
+from citizens.timing import ServerTiming, _current, stage
+from tests.utils import CitizensApiTestCase
+
+
+class TestServerTiming(unittest.TestCase):
+    def test_nested_stages(self):
+        timing = ServerTiming()
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            with stage('outer'):
+                time.sleep(0.02)
+                with stage('inner'):
+                    time.sleep(0.02)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - started
+        # NOTE: время вложенного этапа не входит во внешний
+        self.assertLessEqual(timing.durations['outer'] + timing.durations['inner'], elapsed)
+        self.assertGreaterEqual(timing.durations['outer'], 0.02)
+        self.assertGreaterEqual(timing.durations['inner'], 0.02)
+        self.assertIn('outer;dur=', timing.header())
+
+    def test_disabled(self):
+        with stage('outer'):
+            pass
+        self.assertIsNone(_current.get())
+
+
+class TestServerTimingApi(CitizensApiTestCase):
+    config = {'server_timing': True}
+
+    @unittest_run_loop
+    async def test_server_timing(self):
+        import_id = await self.import_data([{
+            "citizen_id": 1,
+            "town": "Москва",
+            "street": "Льва Толстого",
+            "building": "16к7стр5",
+            "apartment": 7,
+            "name": "Иванов Сергей Иванович",
+            "birth_date": "17.04.1997",
+            "gender": "male",
+            "relatives": []
+        }])
+        uri = f'/imports/{import_id}/towns/stat/percentile/age'
+        response = await self.client.get(uri)
+        self.assertNotIn('Server-Timing', response.headers)
+        response = await self.client.get(uri, headers={'X-Server-Timing': '1'})
+        stages = [item.split(';')[0] for item in response.headers['Server-Timing'].split(', ')]
+        self.assertIn('cache', stages)
+        self.assertIn('total', stages)
+        response = await self.client.patch(f'/imports/{import_id}/citizens/1', json={'name': 'Иван'},
+                                           headers={'X-Server-Timing': '1'})
+        stages = [item.split(';')[0] for item in response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ['read', 'decode', 'validate', 'storage', 'serialize', 'total'])
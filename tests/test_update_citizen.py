@@ -142,11 +142,15 @@ class TestUpdateCitizen(CitizensApiTestCase):
             }
         ])
 
+        citizens_before = list(await self.app.storage.get_citizens(import_id))
         new_data = {
+            'name': 'Алексей',
             'relatives': [2],
         }
         status, data = await self.api_request('PATCH', f'/imports/{import_id}/citizens/1', new_data)
         self.assertEqual(status, 400)
+        # NOTE: если родственника нет, житель не должен измениться
+        self.assertEqual(list(await self.app.storage.get_citizens(import_id)), citizens_before)
 
     @unittest_run_loop
     async def test_self_in_relatives(self):
@@ -1,19 +1,54 @@
+import asyncio
 import json
 from json.decoder import JSONDecodeError
+from os.path import dirname, join, realpath
 
 from aiohttp.test_utils import AioHTTPTestCase
 
 from citizens.app import CitizensRestApi
-from citizens.storage import AsyncMongoStorage
+from citizens.storage import ImportNotFound, CitizenNotFound
+
+CONFIG_FILEPATH = join(dirname(dirname(realpath(__file__))), 'citizens.config.json')
+
+
+def run_loop(coro):
+    def wrapper(self):
+        return self._loop.run_until_complete(coro(self))
+    return wrapper
+
+
+def make_citizen(citizen_id, birth_date='21.12.2012', town='NY', relatives=None, **values):
+    citizen = {
+        'citizen_id': citizen_id,
+        'town': town,
+        'street': 'Lenina',
+        'building': '1b',
+        'apartment': 202,
+        'name': 'Bob',
+        'birth_date': birth_date,
+        'gender': 'male',
+        'relatives': relatives or [],
+    }
+    citizen.update(values)
+    return citizen
 
 
 class CitizensApiTestCase(AioHTTPTestCase):
+    # Ключи конфига поверх citizens.config.json, например чтобы включить выключенное по умолчанию
+    config = {}
+
     async def get_application(self):
-        api = CitizensRestApi(nolog=True)
+        config = None
+        if self.config:
+            with open(CONFIG_FILEPATH) as f:
+                config = dict(json.load(f), **self.config)
+        api = CitizensRestApi(nolog=True, config=config)
         self.app = api._app
         storage_config = api._config['storage']
         storage_config['db'] = 'test_{0}'.format(storage_config['db'])
-        self.app.storage = AsyncMongoStorage(storage_config)
+        self.app.storage = type(self.app.storage)(storage_config)
+        if hasattr(self.app, 'metrics'):
+            self.app.storage.metrics = self.app.metrics
         return self.app
 
     async def api_request(self, http_method, uri, data=None):
@@ -31,3 +66,83 @@ class CitizensApiTestCase(AioHTTPTestCase):
     async def import_data(self, data):
         _, data = await self.api_request('POST', '/imports', {'citizens': data})
         return data['data']['import_id']
+
+
+class StorageTestsMixin:
+    """Общие тесты хранилищ, в наследнике нужно определить `create_storage`."""
+    def create_storage(self):
+        raise NotImplementedError()
+
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self.storage = self.create_storage()
+
+    def tearDown(self):
+        self._loop.run_until_complete(self.storage.close())
+        self._loop.close()
+
+    @run_loop
+    async def test_import(self):
+        citizens = [make_citizen(3, relatives=[1]), make_citizen(1, relatives=[3])]
+        import_id = await self.storage.import_citizens(citizens)
+        self.assertEqual(await self.storage.get_citizens(import_id), citizens)
+        found = await self.storage.get_citizens(import_id, {'citizen_id': [1, 3]}, ['citizen_id'])
+        self.assertEqual(found, [{'citizen_id': 3}, {'citizen_id': 1}])
+        batches = [batch async for batch in self.storage.iter_citizens(import_id, batch_size=1)]
+        self.assertEqual(batches, [[citizens[0]], [citizens[1]]])
+
+    @run_loop
+    async def test_import_does_not_exists(self):
+        with self.assertRaises(ImportNotFound) as ctx:
+            await self.storage.get_citizens(999)
+        self.assertEqual(str(ctx.exception), 'Import `999` does not exists.')
+
+    @run_loop
+    async def test_update_citizen(self):
+        import_id = await self.storage.import_citizens([
+            make_citizen(1, relatives=[2]),
+            make_citizen(2, relatives=[1]),
+            make_citizen(3),
+        ])
+        self.assertEqual(await self.storage.get_import_version(import_id), 1)
+        updated = await self.storage.update_citizen(import_id, 1, {'name': 'Tom', 'relatives': [3, 1]})
+        self.assertEqual(await self.storage.get_import_version(import_id), 2)
+        self.assertEqual(updated['name'], 'Tom')
+        self.assertEqual(updated['relatives'], [3, 1])
+        citizens = {c['citizen_id']: c for c in await self.storage.get_citizens(import_id)}
+        self.assertEqual(citizens[1]['relatives'], [3, 1])
+        self.assertEqual(citizens[2]['relatives'], [])
+        self.assertEqual(citizens[3]['relatives'], [1])
+        with self.assertRaises(CitizenNotFound):
+            await self.storage.update_citizen(import_id, 4, {'name': 'Tom'})
+
+    @run_loop
+    async def test_reports(self):
+        import_id = await self.storage.import_citizens([
+            make_citizen(1, '17.06.1997', 'Москва', relatives=[1, 2, 3]),
+            make_citizen(2, '07.03.1987', 'Москва', relatives=[1]),
+            make_citizen(3, '07.03.1988', 'Амстердам', relatives=[1]),
+        ])
+        presents = await self.storage.get_presents_by_month(import_id)
+        self.assertEqual(presents, [
+            {'month': 3, 'citizens': [{'citizen_id': 1, 'presents': 2}]},
+            {'month': 6, 'citizens': [
+                {'citizen_id': 1, 'presents': 1},
+                {'citizen_id': 2, 'presents': 1},
+                {'citizen_id': 3, 'presents': 1},
+            ]},
+        ])
+        await self.storage.update_citizen(import_id, 1, {'birth_date': '01.01.2000', 'relatives': [2]})
+        presents = await self.storage.get_presents_by_month(import_id)
+        self.assertEqual(presents, [
+            {'month': 1, 'citizens': [{'citizen_id': 2, 'presents': 1}]},
+            {'month': 3, 'citizens': [{'citizen_id': 1, 'presents': 1}]},
+        ])
+        ages = await self.storage.get_ages_by_town(import_id)
+        self.assertEqual([entry['town'] for entry in ages], ['Амстердам', 'Москва'])
+        self.assertEqual(sum(ages[1]['ages'].values()), 2)
+        await self.storage.update_citizen(import_id, 3, {'town': 'Москва'})
+        ages = await self.storage.get_ages_by_town(import_id)
+        self.assertEqual([entry['town'] for entry in ages], ['Москва'])
+        self.assertEqual(sum(ages[0]['ages'].values()), 3)